@@ -0,0 +1,267 @@
+"""Run scripted conversations against characters from the command line.
+
+Each line of the scripts file is one conversation:
+
+    {"id": "greeting", "turns": ["Hi!", "What do you do for fun?"]}
+    {"id": "rude", "turns": ["You're boring."], "characters": ["Blaze (Angry) 🔥"]}
+
+Every script runs against every selected character (or only the characters it
+lists) using the same persona, context window and chat logic as the app.
+Conversations are spread over a process pool; each worker builds its own
+backend once and runs its conversations turn by turn. Transcripts are written
+to `transcripts.jsonl` as they finish, and `stats.json` gets throughput and
+latency percentiles overall and per character.
+
+    python batch_runner.py examples/conversations.jsonl --backend stub --workers 8
+    python batch_runner.py examples/conversations.jsonl --category shy --output-dir runs/shy
+
+The Gemini backend reads the key from GEMINI_API_KEY (or GOOGLE_API_KEY). The
+client-side rate limit (--rpm, default CHARACTER_AI_RATE_LIMIT_RPM or 60) is
+split evenly between the workers, since each process has its own limiter.
+Backends that don't need an API key aren't limited unless --rpm is given.
+Turn latency doesn't include time spent waiting for the limiter; that is
+reported separately as throttle time.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from character_catalog import get_registry
+from group_chat import GroupMember
+from llm_backends import get_backend
+from resilience import ResilientCaller, api_key_id, get_circuit_breaker, get_metrics, get_rate_limiter
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+API_KEY_ENV_VARS = ("GEMINI_API_KEY", "GOOGLE_API_KEY")
+
+
+def load_scripts(path):
+    """Parse the scripts file; raises ValueError on malformed lines."""
+    scripts = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                script = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{line_number}: invalid JSON: {e}") from None
+            turns = script.get("turns") if isinstance(script, dict) else None
+            if not isinstance(turns, list) or not turns or not all(isinstance(turn, str) for turn in turns):
+                raise ValueError(f"{path}:{line_number}: 'turns' must be a non-empty list of strings")
+            scripts.append({
+                "id": str(script.get("id", f"script-{line_number}")),
+                "turns": turns,
+                "characters": script.get("characters"),
+            })
+    return scripts
+
+
+def select_characters(registry, names=None, category=None):
+    if names:
+        unknown = [name for name in names if name not in registry]
+        if unknown:
+            raise ValueError(f"Unknown character(s): {', '.join(unknown)}")
+        return list(names)
+    if category:
+        if category not in registry.names_by_category:
+            raise ValueError(f"Unknown category {category!r}; expected one of: {', '.join(registry.categories)}")
+        return list(registry.names_by_category[category])
+    return list(registry.names)
+
+
+def plan_tasks(scripts, characters):
+    tasks = []
+    for script in scripts:
+        for character in characters:
+            if script["characters"] and character not in script["characters"]:
+                continue
+            tasks.append((character, script["id"], script["turns"]))
+    return tasks
+
+
+# --- Worker process ---
+
+_worker = {}
+
+
+def _init_worker(backend_name, settings, requests_per_minute, workers):
+    backend = get_backend(backend_name)
+    api_key = next((os.environ[name] for name in API_KEY_ENV_VARS if os.environ.get(name)), "")
+    if backend.requires_api_key:
+        if not api_key:
+            raise RuntimeError(f"The {backend.name} backend needs an API key in {' or '.join(API_KEY_ENV_VARS)}")
+        backend.configure(api_key)
+    if requests_per_minute is None and backend.requires_api_key:
+        requests_per_minute = float(os.environ.get("CHARACTER_AI_RATE_LIMIT_RPM", "60"))
+    limiter = None
+    if requests_per_minute: # None or 0: not limited
+        limiter = get_rate_limiter(api_key_id(api_key) if backend.requires_api_key else backend.name,
+                                   requests_per_minute=requests_per_minute / workers)
+    _worker["backend"] = backend
+    _worker["settings"] = settings
+    _worker["caller"] = ResilientCaller(
+        limiter=limiter,
+        breaker=get_circuit_breaker(f"{backend.name}:{settings['model']}"),
+        metrics=get_metrics(),
+    )
+
+
+def run_conversation(task):
+    """Run one scripted conversation in a worker; errors end the conversation but are returned, not raised."""
+    character, script_id, turns = task
+    backend, settings, caller = _worker["backend"], _worker["settings"], _worker["caller"]
+    registry = get_registry()
+    generation_config = {"temperature": settings["temperature"], "max_output_tokens": settings["max_tokens"]}
+
+    def model_for(context_window):
+        return backend.get_model(settings["model"], generation_config,
+                                 system_instruction=context_window.system_instruction())
+
+    started_at = time.perf_counter()
+    result = {"character": character, "script_id": script_id, "model": settings["model"], "pid": os.getpid(),
+              "transcript": [{"role": "assistant", "content": registry.intros[character]}],
+              "turns": [], "error": None}
+    try:
+        member = GroupMember(character, model_for, registry.styles[character], registry.intros[character],
+                             token_budget=settings["token_budget"], keep_last=settings["keep_last"],
+                             recall_k=settings["recall_k"])
+        for text in turns:
+            turn_started_at = time.perf_counter()
+            throttled_before = caller.metrics.snapshot()["throttle_seconds"] # One conversation at a time per worker
+            reply_text = caller.call(lambda: member.send(text))
+            throttle_seconds = caller.metrics.snapshot()["throttle_seconds"] - throttled_before
+            result["turns"].append({"latency": time.perf_counter() - turn_started_at - throttle_seconds,
+                                    "throttle_seconds": throttle_seconds, "usage": member.last_usage})
+            result["transcript"] += [{"role": "user", "content": text}, {"role": "assistant", "content": reply_text}]
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["elapsed"] = time.perf_counter() - started_at
+    return result
+
+
+# --- Stats ---
+
+def percentile(values, pct):
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered), math.ceil(pct / 100.0 * len(ordered))) - 1)]
+
+
+def summarize_latencies(latencies):
+    return {"turns": len(latencies), "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+            "mean": sum(latencies) / len(latencies) if latencies else None}
+
+
+def build_stats(results, wall_seconds, workers):
+    latencies = [turn["latency"] for result in results for turn in result["turns"]]
+    by_character = {}
+    for result in results:
+        entry = by_character.setdefault(result["character"], {"conversations": 0, "errors": 0, "latencies": []})
+        entry["conversations"] += 1
+        entry["errors"] += result["error"] is not None
+        entry["latencies"] += [turn["latency"] for turn in result["turns"]]
+    return {
+        "workers": workers,
+        "conversations": len(results),
+        "errors": sum(result["error"] is not None for result in results),
+        "turns": len(latencies),
+        "wall_seconds": wall_seconds,
+        "turns_per_second": len(latencies) / wall_seconds if wall_seconds else None,
+        "conversations_per_second": len(results) / wall_seconds if wall_seconds else None,
+        "latency": summarize_latencies(latencies),
+        "throttle_seconds": sum(turn["throttle_seconds"] for result in results for turn in result["turns"]),
+        "prompt_tokens": sum(turn["usage"].get("prompt_tokens") or 0 for result in results for turn in result["turns"]),
+        "output_tokens": sum(turn["usage"].get("output_tokens") or 0 for result in results for turn in result["turns"]),
+        "by_character": {
+            name: {"conversations": entry["conversations"], "errors": entry["errors"],
+                   "latency": summarize_latencies(entry["latencies"])}
+            for name, entry in by_character.items()
+        },
+    }
+
+
+def run_batch(tasks, backend_name, settings, workers, transcripts_path, on_result=None, requests_per_minute=None):
+    """Run `tasks` on a pool of `workers` processes, appending each transcript as it finishes.
+
+    `requests_per_minute` limits all workers together; None uses the default
+    limit for backends that need an API key and none for the others.
+    """
+    results = []
+    started_at = time.perf_counter()
+    with open(transcripts_path, "w", encoding="utf-8") as transcripts, ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(backend_name, settings, requests_per_minute, workers)) as pool:
+        futures = [pool.submit(run_conversation, task) for task in tasks]
+        for future in as_completed(futures):
+            result = future.result()
+            transcripts.write(json.dumps(result, ensure_ascii=False) + "\n")
+            results.append(result)
+            if on_result is not None:
+                on_result(result, len(results), len(tasks))
+    return results, time.perf_counter() - started_at
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("scripts", help="JSONL file of scripted conversations")
+    parser.add_argument("--characters", nargs="+", help="character names to run (default: all)")
+    parser.add_argument("--category", help="run every character in this category")
+    parser.add_argument("--backend", help="backend name (default: CHARACTER_AI_BACKEND or gemini)")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help=f"model name (default: {DEFAULT_MODEL})")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--max-tokens", type=int, default=300)
+    parser.add_argument("--token-budget", type=int, default=2000, help="history token budget per conversation")
+    parser.add_argument("--keep-last", type=int, default=6, help="recent turns kept verbatim")
+    parser.add_argument("--recall-k", type=int, default=3, help="earlier exchanges recalled per message")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: CPU count)")
+    parser.add_argument("--rpm", type=float, help="requests per minute across all workers, 0 for no limit "
+                                                  "(default: CHARACTER_AI_RATE_LIMIT_RPM or 60 if the backend needs "
+                                                  "an API key, else no limit)")
+    parser.add_argument("--output-dir", help="where to write transcripts.jsonl and stats.json (default: batch_runs/<time>)")
+    parser.add_argument("--quiet", action="store_true", help="don't print progress")
+    args = parser.parse_args(argv)
+
+    try:
+        scripts = load_scripts(args.scripts)
+        characters = select_characters(get_registry(), args.characters, args.category)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    tasks = plan_tasks(scripts, characters)
+    if not tasks:
+        parser.error("No conversations to run: no script matches the selected characters.")
+    workers = max(1, min(args.workers, len(tasks)))
+    output_dir = args.output_dir or os.path.join("batch_runs", time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(output_dir, exist_ok=True)
+    settings = {"model": args.model, "temperature": args.temperature, "max_tokens": args.max_tokens,
+                "token_budget": args.token_budget, "keep_last": args.keep_last, "recall_k": args.recall_k}
+
+    def report(result, done, total):
+        if not args.quiet:
+            status = "ok" if result["error"] is None else result["error"]
+            print(f"[{done}/{total}] {result['character']} / {result['script_id']}: {result['elapsed']:.2f}s {status}")
+
+    results, wall_seconds = run_batch(tasks, args.backend, settings, workers,
+                                      os.path.join(output_dir, "transcripts.jsonl"), on_result=report,
+                                      requests_per_minute=args.rpm)
+    stats = build_stats(results, wall_seconds, workers)
+    stats["settings"] = dict(settings, backend=args.backend or os.environ.get("CHARACTER_AI_BACKEND") or "gemini")
+    with open(os.path.join(output_dir, "stats.json"), "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2, ensure_ascii=False)
+    latency = stats["latency"]
+    print(f"{stats['conversations']} conversations, {stats['turns']} turns, {stats['errors']} errors in "
+          f"{wall_seconds:.2f}s with {workers} workers ({stats['turns_per_second']:.1f} turns/s)")
+    if latency["turns"]:
+        print(f"turn latency p50 {latency['p50']:.3f}s, p95 {latency['p95']:.3f}s, "
+              f"{stats['throttle_seconds']:.2f}s waiting for the rate limiter")
+    print(f"Wrote {output_dir}/transcripts.jsonl and stats.json")
+    return 1 if stats["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
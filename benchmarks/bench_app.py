@@ -0,0 +1,202 @@
+"""Headless benchmark suite for app reruns and chat turns.
+
+Scenarios (all on the stub backend, see harness.py):
+
+- cold_start:       fresh interpreter -> imports + first script run (subprocess)
+- new_session:      first run of a new session in a warm process
+- sidebar_rerun:    rerun triggered by a sidebar button (Copy Last AI Message)
+- character_switch: picking another character in the sidebar picker
+- chat_turn_<n>:    sending one message with <n> prior exchanges in the chat
+
+Each scenario reports p50/p95 of wall time per interaction, script execution
+time and bytes sent to the browser, plus tracemalloc peak memory of one extra
+pass. Results are written to benchmarks/results/ as JSON; pass --compare with
+an earlier file to see the change per metric.
+
+Run with: python benchmarks/bench_app.py [--runs N] [--compare OLD.json] [--output PATH]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+from harness import ScriptProbe, new_app, summarize  # noqa: E402
+from transcript import assistant_turn, user_turn  # noqa: E402
+
+HISTORY_LENGTHS = (0, 50, 200)
+SWITCH_CHARACTERS = ("Pip (Shy) 🐭", "Fawn (Shy) 🦌")
+
+
+def _character_picker(at):
+    return next(widget for widget in at.sidebar.selectbox if widget.label.startswith("Character ("))
+
+
+def _button(at, label):
+    return next(widget for widget in at.sidebar.button if widget.label == label)
+
+
+def preload_history(at, exchanges):
+    """Put `exchanges` prior user/assistant pairs into a started session."""
+    context_window = at.session_state.context_window
+    messages = list(at.session_state.messages)
+    for i in range(exchanges):
+        user_text = f"Question {i}: tell me something about the stars and the sea."
+        reply_text = f"Answer {i}: " + "the tide remembers every traveler who crossed it " * 4
+        context_window.add_exchange(user_text, reply_text)
+        messages += [user_turn(user_text), assistant_turn(reply_text)]
+    at.session_state.messages = messages
+
+
+def scenario_new_session():
+    def setup():
+        return new_app()
+
+    def step(at, _):
+        at.run()
+    return setup, step
+
+
+def scenario_sidebar_rerun():
+    def setup():
+        at = new_app()
+        at.run()
+        at.chat_input[0].set_value("hello").run()
+        return at
+
+    def step(at, _):
+        _button(at, "📋 Copy Last AI Message").click().run()
+    return setup, step
+
+
+def scenario_character_switch():
+    def setup():
+        at = new_app()
+        at.run()
+        return at
+
+    def step(at, i):
+        _character_picker(at).set_value(SWITCH_CHARACTERS[i % len(SWITCH_CHARACTERS)]).run()
+    return setup, step
+
+
+def scenario_chat_turn(exchanges):
+    def factory():
+        def setup():
+            at = new_app()
+            at.run()
+            preload_history(at, exchanges)
+            at.run()
+            return at
+
+        def step(at, i):
+            at.chat_input[0].set_value(f"benchmark message {i}").run()
+        return setup, step
+    return factory
+
+
+def run_scenario(factory, runs, fresh_setup_per_run=False):
+    probe = ScriptProbe()
+    setup, step = factory()
+    wall = []
+    script = []
+    sent = []
+    with probe.attach():
+        at = None if fresh_setup_per_run else setup()
+        for i in range(runs):
+            if fresh_setup_per_run:
+                at = setup()
+            probe.reset()
+            started_at = time.perf_counter()
+            step(at, i)
+            wall.append(time.perf_counter() - started_at)
+            script.append(sum(probe.script_seconds))
+            sent.append(sum(probe.bytes_sent))
+
+    # Peak memory is measured on a separate pass so tracing doesn't skew the timings
+    at = setup()
+    tracemalloc.start()
+    step(at, runs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wall_seconds": summarize(wall),
+        "script_seconds": summarize(script),
+        "bytes_sent": summarize(sent),
+        "peak_memory_bytes": peak,
+    }
+
+
+def cold_start(runs):
+    """Time imports + first run in a fresh interpreter for each sample."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--cold-start-child"], text=True)
+        samples.append(json.loads(output.strip().splitlines()[-1])["seconds"])
+    return {"wall_seconds": summarize(samples)}
+
+
+def cold_start_child():
+    started_at = time.perf_counter()
+    at = new_app()
+    at.run()
+    print(json.dumps({"seconds": time.perf_counter() - started_at}))
+
+
+def run_all(runs):
+    results = {"cold_start": cold_start(max(3, runs // 4))}
+    results["new_session"] = run_scenario(scenario_new_session, runs, fresh_setup_per_run=True)
+    results["sidebar_rerun"] = run_scenario(scenario_sidebar_rerun, runs)
+    results["character_switch"] = run_scenario(scenario_character_switch, runs)
+    for exchanges in HISTORY_LENGTHS:
+        results[f"chat_turn_{exchanges}"] = run_scenario(scenario_chat_turn(exchanges), runs)
+    return results
+
+
+def _fmt(metric, value):
+    if value is None:
+        return "-"
+    if metric == "bytes_sent":
+        return f"{value / 1024:.1f}KiB"
+    return f"{value * 1000:.1f}ms"
+
+
+def print_report(results, baseline=None):
+    print(f"{'scenario':<18} {'metric':<15} {'p50':>10} {'p95':>10} {'vs base p50':>12}")
+    for name, scenario in results.items():
+        for metric in ("wall_seconds", "script_seconds", "bytes_sent"):
+            stats = scenario.get(metric)
+            if not stats:
+                continue
+            change = ""
+            base = ((baseline or {}).get(name) or {}).get(metric)
+            if base and base["p50"]:
+                change = f"{(stats['p50'] - base['p50']) / base['p50']:+.1%}"
+            print(f"{name:<18} {metric:<15} {_fmt(metric, stats['p50']):>10} {_fmt(metric, stats['p95']):>10} {change:>12}")
+        if "peak_memory_bytes" in scenario:
+            print(f"{name:<18} {'peak_memory':<15} {scenario['peak_memory_bytes'] / 1024 / 1024:>8.1f}MiB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=20, help="samples per scenario (default: 20)")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    parser.add_argument("--output", help="where to write results (default: benchmarks/results/app-<rev>.json)")
+    parser.add_argument("--cold-start-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.cold_start_child:
+        cold_start_child()
+        return
+    results = run_all(args.runs)
+    baseline = harness.load_results(args.compare)["results"] if args.compare else None
+    print_report(results, baseline)
+    print(f"\nSaved to {harness.save_results('app', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Cancellation: how long a reply keeps generating after the user moves on.
+
+Sends a message to a slow stub backend (SLOW_LATENCY seconds to the first
+chunk) and, while the reply is generating, does one of: send another
+message, clear the chat, pick another character. The action reaches the
+running session the way the browser sends it: a rerun request, scoped to the
+widget's fragment if a fragment drew the widget. Streamlit doesn't interrupt
+a running script for a fragment rerun, so an action wired that way waits for
+the reply to finish and the reply is committed anyway.
+
+Reports how long the first reply kept running after the action and whether it
+ended up in the chat. Exits with status 1 if any action failed to cancel it.
+
+Run with: python benchmarks/bench_cancellation.py
+"""
+import contextlib
+import os
+import sys
+import threading
+import time
+
+SLOW_LATENCY = 5.0
+os.environ["CHARACTER_AI_STUB_LATENCY"] = str(SLOW_LATENCY) # Before the harness sets its instant default
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import ScriptProbe, new_app, run_fragment  # noqa: E402
+from streamlit.runtime.scriptrunner_utils.script_requests import RerunData  # noqa: E402
+from streamlit.testing.v1 import local_script_runner  # noqa: E402
+
+from generation import GenerationWorker  # noqa: E402
+
+SLOW_MESSAGE = "slow question"
+
+
+def _clear_button(at):
+    return next(button for button in at.sidebar.button if button.label.startswith("🧹")).click()
+
+
+def _character_picker(at):
+    picker = next(select for select in at.sidebar.selectbox if select.label.startswith("Character ("))
+    return picker.select_index(next(i for i, label in enumerate(picker.options) if not label.startswith(picker.value)))
+
+
+ACTIONS = {
+    "new message": lambda at: at.chat_input[0].set_value("another message"),
+    "clear chat": _clear_button,
+    "switch character": _character_picker,
+}
+
+
+@contextlib.contextmanager
+def watch(runners, jobs):
+    """Record every script runner AppTest starts and every job the app submits."""
+    original_init = local_script_runner.LocalScriptRunner.__init__
+    original_submit = GenerationWorker.submit
+
+    def init(runner, *args, **kwargs):
+        original_init(runner, *args, **kwargs)
+        runners.append(runner)
+
+    def submit(worker, fn, timeout=None):
+        job = original_submit(worker, fn, timeout=timeout)
+        jobs.append(job)
+        return job
+
+    local_script_runner.LocalScriptRunner.__init__ = init
+    GenerationWorker.submit = submit
+    try:
+        yield
+    finally:
+        local_script_runner.LocalScriptRunner.__init__ = original_init
+        GenerationWorker.submit = original_submit
+
+
+def run_widget(at, widget, probe):
+    if widget.id in probe.widget_fragments:
+        return run_fragment(at, widget, probe)
+    return widget.run()
+
+
+def measure(action):
+    probe, runners, jobs = ScriptProbe(), [], []
+    with probe.attach(), watch(runners, jobs):
+        at = new_app()
+        at.run()
+        first_turn = threading.Thread(target=run_widget, args=(at, at.chat_input[0].set_value(SLOW_MESSAGE), probe))
+        first_turn.start()
+        while not jobs: # The reply is generating once its job is submitted
+            time.sleep(0.01)
+        job = jobs[0]
+        at.chat_input[0].set_value(None) # Sent; the browser doesn't send it again with the next event
+        time.sleep(0.5)
+
+        widget = ACTIONS[action](at)
+        acted_at = time.perf_counter()
+        runners[-1].request_rerun(RerunData(widget_states=at._tree.get_widget_states(),
+                                            fragment_id=probe.widget_fragments.get(widget.id)))
+        while job.cancel_reason is None and not job.done():
+            time.sleep(0.005)
+        kept_running = time.perf_counter() - acted_at
+        first_turn.join()
+    committed = any(message.content.startswith(f"(stub reply to: {SLOW_MESSAGE})") for message in at.session_state.messages)
+    return job.cancel_reason, kept_running, committed
+
+
+def main():
+    print(f"Reply takes {SLOW_LATENCY:g}s to start; the action comes 0.5s into it")
+    print(f"{'action':<18} {'reply kept running':>19} {'cancelled':>10} {'committed':>10}")
+    failed = []
+    for action in ACTIONS:
+        cancel_reason, kept_running, committed = measure(action)
+        print(f"{action:<18} {kept_running:>18.2f}s {cancel_reason or 'no':>10} {'yes' if committed else 'no':>10}")
+        if cancel_reason is None or committed:
+            failed.append(action)
+    if failed:
+        print(f"\nNot cancelled: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Character catalog costs: cold load, per-rerun lookup and picker search.
+
+- cold load:  parse and validate every file in characters/ and build the registry
+- per rerun:  what each rerun pays now, `get_registry()` plus the lookups the
+              sidebar does (the directory is only re-scanned every few seconds)
+- search:     picker queries against the prefix index vs a linear substring
+              scan over the same fields, for the real catalog and a synthetic
+              one with thousands of characters
+
+Run with: python benchmarks/bench_character_registry.py [--synthetic N]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from character_catalog import DEFAULT_CATALOG_DIR, CharacterCatalog, get_registry  # noqa: E402
+from character_registry import CharacterRegistry  # noqa: E402
+
+CHARACTER = "Fury (Angry) 💢"
+QUERIES = ("shy", "dr", "intj dreamer", "calm ocean", "zzz")
+
+
+def best_per_call(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def rerun_lookup():
+    registry = get_registry()
+    return registry.styles[CHARACTER], registry.emojis[CHARACTER], registry.search("", limit=50)
+
+
+def linear_search(records, query, limit=50):
+    terms = query.lower().split()
+    results = []
+    for record in records:
+        haystack = " ".join(record.get(field) or "" for field in ("name", "category", "personality_type", "backstory")).lower()
+        if all(term in haystack for term in terms):
+            results.append(record["name"])
+            if len(results) >= limit:
+                break
+    return results
+
+
+def synthetic_records(base_records, count, seed=7):
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        base = rng.choice(base_records)
+        records.append(dict(base, name=f"{base['name'].split(' ')[0]}{i} {base['name'].split(' ')[-1]}"))
+    return records
+
+
+def report_search(label, records):
+    registry = CharacterRegistry(records)
+    print(f"\n{label}: {len(registry)} characters")
+    print(f"  {'query':<14} {'index':>10} {'linear scan':>12} {'matches':>8}")
+    for query in QUERIES:
+        indexed = best_per_call(lambda: registry.search(query), 200)
+        linear = best_per_call(lambda: linear_search(records, query), 20)
+        print(f"  {query!r:<14} {indexed * 1e6:>8.1f}us {linear * 1e6:>10.1f}us {len(registry.search(query, limit=10 ** 9)):>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--synthetic", type=int, default=5000, help="size of the synthetic catalog (default: 5000)")
+    args = parser.parse_args(argv)
+
+    cold = best_per_call(lambda: CharacterCatalog(DEFAULT_CATALOG_DIR).registry(), 20)
+    get_registry() # Warm the process-wide catalog; the first rerun in a process pays the load once
+    per_rerun = best_per_call(rerun_lookup, 20000)
+    print(f"characters:            {len(get_registry())}")
+    print(f"cold catalog load:     {cold * 1e3:9.2f} ms")
+    print(f"per rerun:             {per_rerun * 1e6:9.2f} us")
+
+    records = [
+        {"name": c.name, "category": c.category, "style": c.style, "intro": c.intro,
+         "backstory": (c.details or {}).get("backstory"), "personality_type": (c.details or {}).get("personality_type")}
+        for c in get_registry().characters.values()
+    ]
+    report_search("catalog", records)
+    report_search("synthetic", synthetic_records(records, args.synthetic))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Hedged requests: reply latency with and without hedging on a spiky backend.
+
+Streams replies from the stub backend with a latency tail: SLOW_RATE of the
+requests wait SLOW_FACTOR times longer for their first chunk, the way Gemini
+occasionally does. Clients send requests concurrently through a
+GenerationWorker, as the app does. Each reply is sent either once, or through
+a Hedger that sends a duplicate once the first chunk is later than the p95 of
+recent ones. The hedger learns that p95 from the first MIN_SAMPLES requests.
+
+Reports time to first token and total reply time (p50/p95/p99), and the extra
+requests hedging cost.
+
+Run with: python benchmarks/bench_hedging.py [--requests N] [--clients N]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generation import GenerationWorker  # noqa: E402
+from hedging import Hedger  # noqa: E402
+from llm_backends import StubBackend  # noqa: E402
+from streaming import TurnTiming, timed_chunks  # noqa: E402
+
+MODEL_NAME = "gemini-2.0-flash"
+LATENCY = 0.4 # Seconds to the first chunk, about what Gemini Flash takes
+CHUNK_DELAY = 0.01
+SLOW_RATE = 0.05
+SLOW_FACTOR = 10.0
+MESSAGE = "How was the sea today?"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+def run(strategy, requests, clients):
+    backend = StubBackend(latency=LATENCY, chunk_delay=CHUNK_DELAY, slow_rate=SLOW_RATE, slow_factor=SLOW_FACTOR, seed=7)
+    model = backend.get_model(MODEL_NAME, {"temperature": 0.7, "max_output_tokens": 256})
+    worker = GenerationWorker(max_workers=clients, timeout=30)
+    hedger = Hedger() if strategy == "hedged" else None
+
+    def one_request(i):
+        started_at = time.perf_counter()
+
+        def generate(job):
+            chat = model.start_chat(history=[{"role": "user", "parts": [f"conversation {i}"]}])
+            job.timing = TurnTiming(started_at)
+            for chunk in timed_chunks(chat.stream_message(MESSAGE, timeout=job.remaining()), job.timing):
+                job.add_chunk(chunk)
+            return job.partial_text()
+
+        def work(job):
+            if hedger is None:
+                return generate(job)
+            return hedger.call(job, MODEL_NAME, generate)
+
+        job = worker.submit(work)
+        job.wait()
+        return job.timing.time_to_first_token, job.timing.total_time
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(one_request, range(requests)))
+    stats = hedger.stats() if hedger is not None else {"requests": requests, "hedges": 0, "hedge_wins": 0}
+    return [ttft for ttft, _ in results], [total for _, total in results], stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--clients", type=int, default=16)
+    args = parser.parse_args(argv)
+
+    print(f"{args.requests} requests, {args.clients} concurrent, {SLOW_RATE:.0%} of them {SLOW_FACTOR:g}x slower "
+          f"to start ({LATENCY * 1e3:.0f}ms first chunk normally)")
+    print(f"{'strategy':<10} {'ttft p50':>9} {'ttft p95':>9} {'ttft p99':>9} {'total p95':>10} {'total p99':>10} "
+          f"{'extra requests':>15}")
+    for strategy in ("single", "hedged"):
+        ttfts, totals, stats = run(strategy, args.requests, args.clients)
+        extra = f"{stats['hedges'] / stats['requests']:.1%} ({stats['hedge_wins']} won)"
+        print(f"{strategy:<10} {percentile(ttfts, 50) * 1e3:>7.0f}ms {percentile(ttfts, 95) * 1e3:>7.0f}ms "
+              f"{percentile(ttfts, 99) * 1e3:>7.0f}ms {percentile(totals, 95) * 1e3:>8.0f}ms "
+              f"{percentile(totals, 99) * 1e3:>8.0f}ms {extra:>15}")
+
+
+if __name__ == "__main__":
+    main()
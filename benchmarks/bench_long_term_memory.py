@@ -0,0 +1,81 @@
+"""Long-term memory: index update and query time, prompt size and recall.
+
+Builds conversations of increasing length in which a few facts are planted
+early and later buried under small talk, then asks about each fact.
+
+- update:  time to add one exchange to the index, averaged over the conversation
+- query:   time to find the top-k snippets for a question
+- prompt:  estimated prompt tokens for the question, with the context window
+           (summary + recent turns + recalled snippets) vs replaying everything
+- recall:  share of questions whose planted fact made it into the prompt, with
+           and without long-term memory
+
+Run with: python benchmarks/bench_long_term_memory.py
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_window import ContextWindow  # noqa: E402
+from long_term_memory import ConversationMemory  # noqa: E402
+
+LENGTHS = (100, 1000, 10000)
+FACTS = [
+    ("My dog is called Biscuit and he is terrified of seagulls.", "What is my dog called?", "Biscuit"),
+    ("I grew up in Tromsø, above the Arctic circle.", "Where did I grow up?", "Tromsø"),
+    ("My sister Ingrid plays the cello in an orchestra.", "Which instrument does my sister play?", "cello"),
+    ("I'm allergic to hazelnuts, so no pralines for me.", "What am I allergic to?", "hazelnuts"),
+    ("My first car was a rusty green Volvo.", "What was my first car?", "Volvo"),
+]
+SMALL_TALK = ("weather", "stars", "music", "breakfast", "trains", "books", "rain", "tea", "movies", "the sea",
+              "gardens", "cities", "mountains", "winter", "games", "painting", "history", "the moon")
+REPLY = "Oh, that reminds me of a story about {topic}; the tide remembers every traveler who crossed it."
+
+
+def conversation(length, seed=3):
+    rng = random.Random(seed)
+    exchanges = [(fact, "How wonderful, I will remember that!") for fact, _, _ in FACTS]
+    for i in range(length - len(FACTS)):
+        topic = rng.choice(SMALL_TALK)
+        exchanges.append((f"Let's talk about {topic} for a bit, message {i}.", REPLY.format(topic=topic)))
+    return exchanges
+
+
+def prompt_text(history):
+    return "\n".join(part for message in history for part in message["parts"])
+
+
+def main():
+    print(f"{'exchanges':>9} {'update':>9} {'query':>9} {'prompt (window)':>16} {'prompt (full)':>14} "
+          f"{'recall (summary only)':>22} {'recall (memory)':>16}")
+    for length in LENGTHS:
+        exchanges = conversation(length)
+
+        def build_index():
+            memory = ConversationMemory()
+            for user_text, model_text in exchanges:
+                memory.add(user_text, model_text)
+            return memory
+
+        update = min(timeit.repeat(build_index, number=1, repeat=3)) / length
+        memory = build_index()
+        query = min(timeit.repeat(lambda: [memory.search(question, k=3) for _, question, _ in FACTS],
+                                  number=20, repeat=3)) / (20 * len(FACTS))
+
+        with_memory = ContextWindow("persona", "intro", recall_k=3)
+        without_memory = ContextWindow("persona", "intro", recall_k=0)
+        for user_text, model_text in exchanges:
+            with_memory.add_exchange(user_text, model_text)
+            without_memory.add_exchange(user_text, model_text)
+        managed_tokens, full_tokens = zip(*(with_memory.prompt_tokens(question) for _, question, _ in FACTS))
+        recalled = sum(answer in prompt_text(with_memory.build_history(question)) for _, question, answer in FACTS)
+        summarized = sum(answer in prompt_text(without_memory.build_history(question)) for _, question, answer in FACTS)
+        print(f"{length:>9} {update * 1e6:>7.1f}us {query * 1e6:>7.1f}us {max(managed_tokens):>16} {max(full_tokens):>14} "
+              f"{summarized:>18}/{len(FACTS)} {recalled:>12}/{len(FACTS)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Memory held per chat session at 100 and 1000 turns.
+
+Builds the state one session keeps between turns, after its last reply:
+
+- "dicts + sdk history": the old layout, a list of `{"role", "content"}`
+  dicts plus the chat session still holding the last replayed history
+  (converted to SDK Content objects) and the new exchange
+- "turns": slotted transcript.Turn records with interned roles; the chat
+  session is started without history (each send replays the context window
+  into a chat of its own), so it holds none between turns
+
+Python heap is measured with tracemalloc. The Gemini SDK keeps Content in
+protobuf memory that tracemalloc can't see, so its history is reported
+separately as serialized bytes. Message text is generated per message, the
+way replies arrive from the backend, so nothing is shared by accident.
+
+Run with: python benchmarks/bench_memory.py
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from character_catalog import get_registry  # noqa: E402
+from context_window import ContextWindow  # noqa: E402
+from transcript import assistant_turn, user_turn  # noqa: E402
+
+TURN_COUNTS = (100, 1000)
+CHARACTER = "Luna 🌙"
+MODEL_NAME = "gemini-2.0-flash"
+
+
+def message_texts(turns):
+    for i in range(turns):
+        yield (f"Question {i}: what do you think about the stars tonight, and the sea?",
+               f"Answer {i}: " + "the tide remembers every traveler who crossed it, " * 4)
+
+
+def gemini_session(context_window):
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        return None, None
+    model = genai.GenerativeModel(MODEL_NAME, system_instruction=context_window.system_instruction())
+    return model.start_chat(history=[]), genai.protos.Content
+
+
+def build_session(turns, layout):
+    registry = get_registry()
+    context_window = ContextWindow(registry.styles[CHARACTER], registry.intros[CHARACTER])
+    chat, content_type = gemini_session(context_window)
+    if layout == "dicts + sdk history":
+        messages = [{"role": "assistant", "content": registry.intros[CHARACTER]}]
+        for user_text, reply_text in message_texts(turns):
+            messages += [{"role": "user", "content": user_text}, {"role": "assistant", "content": reply_text}]
+            if chat is not None:
+                # What the session held after the turn: the replayed history plus the new exchange
+                chat.history = context_window.build_history() + [
+                    {"role": "user", "parts": [user_text]}, {"role": "model", "parts": [reply_text]}]
+            context_window.add_exchange(user_text, reply_text)
+    else:
+        messages = [assistant_turn(registry.intros[CHARACTER])]
+        for user_text, reply_text in message_texts(turns):
+            messages += [user_turn(user_text), assistant_turn(reply_text)]
+            context_window.add_exchange(user_text, reply_text)
+    sdk_bytes = sum(content_type.pb(content).ByteSize() for content in chat.history) if chat is not None else 0
+    return (messages, context_window, chat), sdk_bytes
+
+
+def measure(turns, layout):
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    session, sdk_bytes = build_session(turns, layout)
+    gc.collect()
+    heap_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    del session
+    return heap_bytes, sdk_bytes
+
+
+def main():
+    get_registry() # Load the catalog outside the measured region
+    gemini_session(ContextWindow("warm up", "imports"))
+    print(f"{'turns':>6}  {'layout':<20} {'python heap':>12} {'sdk history':>12} {'total':>12} {'per turn':>10}")
+    for turns in TURN_COUNTS:
+        for layout in ("dicts + sdk history", "turns"):
+            heap_bytes, sdk_bytes = measure(turns, layout)
+            total = heap_bytes + sdk_bytes
+            print(f"{turns:>6}  {layout:<20} {heap_bytes / 1024:>9.1f}KiB {sdk_bytes / 1024:>9.1f}KiB "
+                  f"{total / 1024:>9.1f}KiB {total / turns:>8.0f}B")
+
+
+if __name__ == "__main__":
+    main()
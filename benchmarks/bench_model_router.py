@@ -0,0 +1,135 @@
+"""Model routing: turn latency and errors with auto-routing vs a fixed model.
+
+Simulates a day of chat turns against two models on a fake clock, so it runs
+in a second. 70% of turns are short messages, 30% are long messages or have a
+large reply budget. The light model answers faster than the heavy one, and
+things go wrong on the way:
+
+- turns 1000-2000: the heavy model is overloaded and 4x slower
+- turns 2000-2500: the light model is out of quota (429 on every call)
+
+Each strategy sees the same turns. A fixed model gets one attempt per turn
+(the app's retries wouldn't outlast the outage). Auto-routing gets the
+ModelRouter's decision and fallbacks. Reports turn latency p50/p95, failed
+turns, fallbacks, the share of turns answered by the heavy model, and the
+router's own cost per decision. Reply quality isn't modelled; routing light
+requests to the light model trades some of it for latency by design.
+
+Run with: python benchmarks/bench_model_router.py [--turns N]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_router import ModelRouter, RouteDecision  # noqa: E402
+
+LIGHT_MODEL = "gemini-2.0-flash-lite"
+HEAVY_MODEL = "gemini-2.0-flash"
+TURN_TIMEOUT = 60.0
+SHORT_MESSAGE = "How was your day? Tell me about the sea."
+LONG_MESSAGE = "Tell me a long story about the lighthouse keeper and the storm. " * 40
+
+
+class ResourceExhausted(Exception):
+    code = 429
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def workload(turns, seed=11):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(turns):
+        if rng.random() < 0.7:
+            requests.append((SHORT_MESSAGE, 300, rng.randint(60, 250)))
+        elif rng.random() < 0.5:
+            requests.append((LONG_MESSAGE, 300, rng.randint(150, 300)))
+        else:
+            requests.append((SHORT_MESSAGE, 1024, rng.randint(400, 1000)))
+    return requests
+
+
+def call_latency(model, turn, output_tokens, rng, turns):
+    if model == HEAVY_MODEL:
+        latency = 0.8 + 0.008 * output_tokens
+        if turns * 1 // 3 <= turn < turns * 2 // 3:
+            latency *= 4
+    else:
+        latency = 0.4 + 0.004 * output_tokens
+    return latency * rng.lognormvariate(0, 0.25)
+
+
+def simulate(strategy, requests):
+    clock = FakeClock()
+    router = ModelRouter(light_model=LIGHT_MODEL, heavy_model=HEAVY_MODEL, clock=clock)
+    rng = random.Random(5)
+    turns = len(requests)
+    latencies, failed, fallbacks, heavy_turns = [], 0, 0, 0
+    for turn, (text, max_tokens, output_tokens) in enumerate(requests):
+        def attempt(model, timeout, can_fall_back):
+            if model == LIGHT_MODEL and turns * 2 // 3 <= turn < turns * 5 // 6:
+                clock.now += 0.1
+                raise ResourceExhausted("429 quota exceeded")
+            latency = call_latency(model, turn, output_tokens, rng, turns)
+            if latency > timeout:
+                clock.now += timeout
+                raise TimeoutError(f"timed out after {timeout:.1f}s")
+            clock.now += latency
+            return model
+
+        decision = router.route(text, max_tokens)
+        if strategy != "auto":
+            decision = RouteDecision(decision.size, [strategy], []) # Same request size, one fixed model
+        started_at = clock.now
+        deadline = started_at + TURN_TIMEOUT
+        try:
+            model = router.call(decision, attempt, remaining=lambda: max(0.0, deadline - clock.now))
+        except (ResourceExhausted, TimeoutError):
+            failed += 1
+        else:
+            heavy_turns += model == HEAVY_MODEL
+        latencies.append(clock.now - started_at)
+        fallbacks += len(decision.fallbacks)
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "failed": failed,
+        "fallbacks": fallbacks,
+        "heavy_share": heavy_turns / (turns - failed) if turns > failed else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--turns", type=int, default=3000)
+    args = parser.parse_args(argv)
+    requests = workload(args.turns)
+
+    print(f"{args.turns} turns")
+    print(f"{'strategy':<22} {'p50':>7} {'p95':>7} {'failed':>7} {'fallbacks':>10} {'heavy model':>12}")
+    for strategy in (HEAVY_MODEL, LIGHT_MODEL, "auto"):
+        result = simulate(strategy, requests)
+        print(f"{strategy:<22} {result['p50']:>6.2f}s {result['p95']:>6.2f}s {result['failed']:>7} "
+              f"{result['fallbacks']:>10} {result['heavy_share']:>11.0%}")
+
+    router = ModelRouter(light_model=LIGHT_MODEL, heavy_model=HEAVY_MODEL)
+    for _ in range(200):
+        router.record(LIGHT_MODEL, "light", 0.5, True)
+        router.record(HEAVY_MODEL, "light", 1.0, True)
+    per_decision = min(timeit.repeat(lambda: router.route(SHORT_MESSAGE, 300), number=2000, repeat=3)) / 2000
+    print(f"\nrouting decision: {per_decision * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Per-turn prompt tokens and latency with the persona as a cached system instruction.
+
+Runs a scripted conversation against the stub backend in three layouts:
+
+- "persona-in-history": the old layout, persona and intro replayed as the
+  first user/model turns on every send
+- "system-instruction": persona + intro as the model's system instruction,
+  prefix cache off
+- "prefix-cached":      the same, with the prefix cache on (the default)
+
+For each it reports prompt tokens per turn, how many of them were served
+from the prefix cache, the uncached remainder (what has to be prefilled and
+billed at the full rate) and time to reply. The stub charges
+PREFILL_PER_1K seconds per 1000 uncached prompt tokens so the latency
+difference is visible offline.
+
+The stub caches what the Gemini backend would: only a system instruction of
+at least MIN_CACHED_PREFIX_TOKENS, Gemini's minimum for an explicit cache.
+The shipped personas are far shorter, so they aren't cached; pass
+--min-cached-tokens 0 to see what caching would save if they were.
+
+Run with: python benchmarks/bench_prompt_cache.py [--turns N] [--min-cached-tokens N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from character_catalog import get_registry  # noqa: E402
+from context_window import ContextWindow, estimate_tokens  # noqa: E402
+from llm_backends import MIN_CACHED_PREFIX_TOKENS, StubBackend  # noqa: E402
+
+MODEL_NAME = "gemini-2.0-flash"
+GENERATION_CONFIG = {"temperature": 0.7, "max_output_tokens": 256}
+PREFILL_PER_1K = 0.05
+CHARACTER = "Luna 🌙"
+LAYOUTS = ("persona-in-history", "system-instruction", "prefix-cached")
+
+
+def persona_for(character):
+    registry = get_registry()
+    return registry.styles[character], registry.intros[character]
+
+
+def run_layout(layout, turns, persona, intro, min_cached_tokens=MIN_CACHED_PREFIX_TOKENS):
+    backend = StubBackend(latency=0, chunk_delay=0, prefill_per_1k=PREFILL_PER_1K,
+                          prefix_cache=layout == "prefix-cached", min_cached_tokens=min_cached_tokens)
+    context_window = ContextWindow(persona, intro)
+    if layout == "persona-in-history":
+        model = backend.get_model(MODEL_NAME, GENERATION_CONFIG)
+        preamble = [{"role": "user", "parts": [persona]}, {"role": "model", "parts": [intro]}]
+    else:
+        model = backend.get_model(MODEL_NAME, GENERATION_CONFIG, system_instruction=context_window.system_instruction())
+        preamble = []
+    chat = model.start_chat()
+    prompt_tokens, cached_tokens, latencies = [], [], []
+    for turn in range(turns):
+        text = f"Turn {turn}: tell me what you see in the night sky tonight."
+        chat.history = preamble + context_window.build_history()
+        started_at = time.perf_counter()
+        reply_text = chat.send_message(text).text
+        latencies.append(time.perf_counter() - started_at)
+        prompt_tokens.append(chat.last_usage["prompt_tokens"])
+        cached_tokens.append(chat.last_usage.get("cached_tokens", 0))
+        context_window.add_exchange(text, reply_text)
+    uncached = [total - cached for total, cached in zip(prompt_tokens, cached_tokens)]
+    return {
+        "prompt_tokens": statistics.fmean(prompt_tokens),
+        "cached_tokens": statistics.fmean(cached_tokens),
+        "uncached_tokens": statistics.fmean(uncached),
+        "latency": statistics.fmean(latencies),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--turns", type=int, default=20, help="turns per conversation (default: 20)")
+    parser.add_argument("--character", default=CHARACTER, help="character whose persona is used")
+    parser.add_argument("--min-cached-tokens", type=int, default=MIN_CACHED_PREFIX_TOKENS,
+                        help=f"smallest system instruction that is cached (default: {MIN_CACHED_PREFIX_TOKENS}, as on Gemini)")
+    args = parser.parse_args(argv)
+    persona, intro = persona_for(args.character)
+    system_tokens = estimate_tokens(ContextWindow(persona, intro).system_instruction())
+    print(f"System instruction: ~{system_tokens} tokens; cached from {args.min_cached_tokens} tokens "
+          f"({'cached' if system_tokens >= args.min_cached_tokens else 'not cached'})")
+    print(f"{'layout':<20} {'prompt tok':>10} {'cached tok':>10} {'uncached tok':>12} {'latency':>10}")
+    results = {layout: run_layout(layout, args.turns, persona, intro, args.min_cached_tokens) for layout in LAYOUTS}
+    for layout, stats in results.items():
+        print(f"{layout:<20} {stats['prompt_tokens']:>10.0f} {stats['cached_tokens']:>10.0f} "
+              f"{stats['uncached_tokens']:>12.0f} {stats['latency'] * 1000:>8.1f}ms")
+    baseline = results["persona-in-history"]["uncached_tokens"]
+    cached = results["prefix-cached"]["uncached_tokens"]
+    print(f"\nUncached prompt tokens per turn: {baseline:.0f} -> {cached:.0f} ({(cached - baseline) / baseline:+.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Rerun time of the chat pane with and without windowed rendering.
+
+Drives app.py headlessly with Streamlit's AppTest on the stub backend, loads
+a transcript of 10, 100 and 1000 messages into session state and times plain
+reruns. "all" renders every message (the old behaviour); "windowed" renders
+the default RENDER_WINDOW_SIZE most recent ones.
+
+Run with: python benchmarks/bench_render.py
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import new_app  # noqa: E402
+from transcript import Turn  # noqa: E402
+
+SIZES = (10, 100, 1000)
+RERUNS = 5
+RENDER_ALL = 10 ** 9
+
+
+def make_transcript(count):
+    return [
+        Turn("user" if i % 2 else "assistant", f"Message {i}: " + "lorem ipsum dolor sit amet " * 8)
+        for i in range(count)
+    ]
+
+
+def measure(count, render_window):
+    at = new_app()
+    at.run()
+    at.session_state.messages = make_transcript(count)
+    if render_window is not None:
+        at.session_state.render_window = render_window
+    timings = []
+    for _ in range(RERUNS):
+        started_at = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - started_at)
+    rendered = [m.markdown[0].value for m in at.chat_message]
+    return statistics.median(timings), len(rendered), sum(len(text.encode("utf-8")) for text in rendered)
+
+
+if __name__ == "__main__":
+    print(f"{'messages':>8}  {'mode':>8}  {'rerun (median)':>14}  {'rendered':>8}  {'markdown bytes':>14}")
+    for count in SIZES:
+        for mode, window in (("all", RENDER_ALL), ("windowed", None)):
+            seconds, rendered, payload = measure(count, window)
+            print(f"{count:>8}  {mode:>8}  {seconds * 1000:>11.1f} ms  {rendered:>8}  {payload:>14}")
@@ -0,0 +1,89 @@
+"""Rerun scope: script time and bytes sent per interaction, fragment vs full rerun.
+
+Parts of the page are fragments: changing a model setting reruns only that
+part of the sidebar, and the chat pane's own buttons rerun only the chat pane.
+Sending a message reruns the whole app, so that it interrupts a reply still
+generating (see bench_cancellation.py); a chat turn costs what it did before
+fragments, and its fragment row says so instead of showing a saving. For each
+interaction this measures the rerun the browser asks for (only the fragment
+that owns the widget) next to a full rerun of the same app, which is what
+every interaction cost before. Pass --app with another revision's app.py, e.g.
+
+    git show <rev>:app.py > /tmp/app_before.py
+    python benchmarks/bench_rerun_scope.py --app /tmp/app_before.py
+
+to measure it the same way; an app without fragments always reruns in full.
+
+Runs from the repository root so .streamlit/config.toml (static file serving
+for the theme stylesheet) applies, as it does for `streamlit run app.py`, and
+compiles the script once, as the server does.
+
+Run with: python benchmarks/bench_rerun_scope.py [--runs N] [--history N] [--app PATH]
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+from bench_app import preload_history  # noqa: E402
+from harness import ScriptProbe, new_app, percentile, reuse_compiled_script, run_fragment  # noqa: E402
+
+
+def _sidebar_widget(widgets, label_prefix):
+    return next(widget for widget in widgets if widget.label.startswith(label_prefix))
+
+
+INTERACTIONS = {
+    "chat_turn": lambda at, i: at.chat_input[0].set_value(f"benchmark message {i}"),
+    "sidebar_slider": lambda at, i: _sidebar_widget(at.sidebar.slider, "Temperature").set_value(0.3 if i % 2 else 0.7),
+    "sidebar_button": lambda at, i: _sidebar_widget(at.sidebar.button, "📋 Copy").click(),
+}
+
+
+def measure(app_path, interaction, scope, runs, history):
+    probe = ScriptProbe()
+    script_seconds, bytes_sent = [], []
+    with probe.attach(), reuse_compiled_script():
+        at = new_app(app_path=app_path)
+        at.run()
+        preload_history(at, history)
+        at.run()
+        for i in range(runs):
+            widget = INTERACTIONS[interaction](at, i)
+            probe.reset()
+            if scope == "fragment" and widget.id in probe.widget_fragments:
+                run_fragment(at, widget, probe)
+            else:
+                scope = "full"
+                widget.run()
+            script_seconds.append(sum(probe.script_seconds))
+            bytes_sent.append(sum(probe.bytes_sent))
+            at.run() # Back to the whole page, so the next interaction finds every widget
+    return scope, script_seconds, bytes_sent
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=20, help="samples per interaction (default: 20)")
+    parser.add_argument("--history", type=int, default=50, help="exchanges already in the chat (default: 50)")
+    parser.add_argument("--app", default=harness.APP_PATH, help="app script to measure (default: this tree's app.py)")
+    args = parser.parse_args(argv)
+    os.chdir(harness.ROOT)
+
+    print(f"{os.path.relpath(args.app)}, {args.history} exchanges in the chat")
+    print(f"{'interaction':<15} {'rerun':<9} {'script p50':>11} {'script p95':>11} {'bytes p50':>10}")
+    for interaction in INTERACTIONS:
+        for scope in ("full", "fragment"):
+            measured_scope, script_seconds, bytes_sent = measure(args.app, interaction, scope, args.runs, args.history)
+            if measured_scope != scope:
+                # No fragment owns the widget: the browser asks for the full rerun listed above
+                print(f"{interaction:<15} {scope:<9} {'none, reruns the full app':>35}")
+                continue
+            print(f"{interaction:<15} {scope:<9} {percentile(script_seconds, 50) * 1e3:>9.1f}ms "
+                  f"{percentile(script_seconds, 95) * 1e3:>9.1f}ms {percentile(bytes_sent, 50) / 1024:>7.1f}KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Server memory with many idle sessions, with and without the session memory cap.
+
+Simulates N browser sessions that each chatted for a while and went idle
+(plain dicts stand in for each session's state), then one user returning.
+Reports the Python heap held by all sessions (tracemalloc), the manager's own
+estimate, how many sessions were spilled, and what a spill and a rehydration
+cost.
+
+Run with: python benchmarks/bench_session_manager.py [--sessions N] [--turns N] [--cap-mb N]
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from character_catalog import get_registry  # noqa: E402
+from context_window import ContextWindow  # noqa: E402
+from session_cache import CharacterSessionCache  # noqa: E402
+from session_manager import SessionManager  # noqa: E402
+from transcript import assistant_turn, user_turn  # noqa: E402
+
+
+def make_state(session_number, turns, character, registry):
+    context_window = ContextWindow(registry.styles[character], registry.intros[character])
+    messages = [assistant_turn(registry.intros[character])]
+    for i in range(turns):
+        user_text = f"Session {session_number}, question {i}: what do you think about the stars tonight?"
+        reply_text = f"Answer {i}: " + "the tide remembers every traveler who crossed it, " * 4
+        messages += [user_turn(user_text), assistant_turn(reply_text)]
+        context_window.add_exchange(user_text, reply_text)
+    return {"messages": messages, "context_window": context_window, "chat_session": object(), "model_instance": None,
+            "current_character_for_session": character, "conversation_user_id": "", "conversation_id": None,
+            "oldest_loaded_seq": None, "render_window": 30, "group_messages": [], "group_members": {},
+            "character_sessions": CharacterSessionCache()}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(sessions, turns, cap_bytes, spill_dir):
+    registry = get_registry()
+    clock = Clock()
+    manager = SessionManager(max_bytes=cap_bytes, idle_seconds=60, spill_dir=spill_dir, clock=clock)
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    states = {}
+    spill_seconds = 0.0
+    for n in range(sessions):
+        session_key = f"session-{n}"
+        states[session_key] = make_state(n, turns, registry.names[n % len(registry)], registry)
+        manager.checkin(session_key, states[session_key])
+        clock.now += 5 # Sessions arrive over time; older ones go idle
+        started_at = time.perf_counter()
+        manager.update(session_key, states[session_key])
+        spill_seconds += time.perf_counter() - started_at
+    gc.collect()
+    heap_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    stats = manager.stats()
+    started_at = time.perf_counter()
+    manager.checkin("session-0", states["session-0"]) # The first user comes back
+    rehydrate_seconds = time.perf_counter() - started_at
+    return heap_bytes, stats, spill_seconds, rehydrate_seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--cap-mb", type=float, default=8.0)
+    args = parser.parse_args(argv)
+    get_registry()
+
+    print(f"{args.sessions} sessions x {args.turns} turns")
+    print(f"{'cap':>10} {'python heap':>12} {'estimate':>10} {'in memory':>10} {'spilled':>8} "
+          f"{'update total':>13} {'rehydrate':>10}")
+    for label, cap_bytes in (("none", float("inf")), (f"{args.cap_mb:g} MiB", args.cap_mb * 1024 * 1024)):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            heap_bytes, stats, spill_seconds, rehydrate_seconds = run(args.sessions, args.turns, cap_bytes, spill_dir)
+        print(f"{label:>10} {heap_bytes / 1024 / 1024:>9.1f}MiB {stats['bytes'] / 1024 / 1024:>7.1f}MiB "
+              f"{stats['in_memory']:>10} {stats['spilled']:>8} {spill_seconds * 1e3:>11.1f}ms {rehydrate_seconds * 1e3:>8.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Startup cost: SDK import time and time to first paint on the Gemini backend.
+
+Every sample runs in a fresh interpreter, so nothing is already imported:
+
+- import:           `import streamlit` and `import google.generativeai` on their own
+- first paint:      process start until the first script run has finished
+                    (the API key screen), with the SDK deferred as the app does
+                    now vs imported up front as it used to be
+- key entered:      the run after a key is typed in, which is where the SDK is
+                    now imported and configured
+- rerun:            a later rerun with the key set, and how many times the SDK
+                    was configured over those reruns
+
+No network access is needed: the key is a dummy, and configuring the SDK and
+building a model with a short persona make no requests.
+
+Run with: python benchmarks/bench_startup.py [--runs N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+RERUNS = 5
+
+
+def child(mode):
+    started_at = time.perf_counter()
+    if mode == "import":
+        import streamlit  # noqa: F401
+        streamlit_seconds = time.perf_counter() - started_at
+        sdk_started_at = time.perf_counter()
+        import google.generativeai  # noqa: F401
+        return {"streamlit": streamlit_seconds, "sdk": time.perf_counter() - sdk_started_at}
+
+    if mode == "eager":
+        import google.generativeai  # noqa: F401 - what every cold start used to pay
+    from streamlit.testing.v1 import AppTest
+    sys.path.insert(0, ROOT)
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    result = {"first_paint": time.perf_counter() - started_at, "sdk_loaded": "google.generativeai" in sys.modules,
+              "since_launch": time.time() - float(os.environ["BENCH_LAUNCHED_AT"])}
+    if mode == "lazy":
+        key_started_at = time.perf_counter()
+        at.sidebar.text_input[0].set_value("dummy-key-for-benchmark").run()
+        result["key_entered"] = time.perf_counter() - key_started_at
+        rerun_seconds = []
+        for _ in range(RERUNS):
+            rerun_started_at = time.perf_counter()
+            at.run()
+            rerun_seconds.append(time.perf_counter() - rerun_started_at)
+        result["rerun"] = statistics.median(rerun_seconds)
+        from llm_backends import get_backend
+        result["configure_calls"] = get_backend().configure_calls
+        result["errors"] = [e.value for e in at.exception]
+    return result
+
+
+def sample(mode):
+    env = dict(os.environ, CHARACTER_AI_BACKEND="gemini", CHARACTER_AI_TELEMETRY_PATH="",
+               BENCH_LAUNCHED_AT=repr(time.time()))
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), "--child", mode],
+                                     env=env, text=True, stderr=subprocess.DEVNULL)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median_of(results, field):
+    return statistics.median(result[field] for result in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        print(json.dumps(child(args.child)))
+        return
+
+    imports = [sample("import") for _ in range(args.runs)]
+    print(f"import streamlit:              {median_of(imports, 'streamlit') * 1e3:8.1f} ms")
+    print(f"import google.generativeai:    {median_of(imports, 'sdk') * 1e3:8.1f} ms")
+    print()
+    for mode, label in (("eager", "SDK imported up front"), ("lazy", "SDK deferred")):
+        results = [sample(mode) for _ in range(args.runs)]
+        print(f"{label}:")
+        print(f"  first paint (in process):    {median_of(results, 'first_paint') * 1e3:8.1f} ms"
+              f"  (SDK loaded: {results[0]['sdk_loaded']})")
+        print(f"  first paint (process start): {median_of(results, 'since_launch') * 1e3:8.1f} ms")
+        if mode == "lazy":
+            print(f"  key entered run:             {median_of(results, 'key_entered') * 1e3:8.1f} ms")
+            print(f"  rerun with key:              {median_of(results, 'rerun') * 1e3:8.1f} ms"
+                  f"  (SDK configured {results[0]['configure_calls']}x over {RERUNS + 1} runs)")
+            if results[0]["errors"]:
+                print(f"  errors: {results[0]['errors']}")
+
+
+if __name__ == "__main__":
+    main()
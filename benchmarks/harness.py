@@ -0,0 +1,173 @@
+"""Shared helpers for the headless app benchmarks.
+
+Drives app.py with Streamlit's AppTest on the stub backend, so nothing here
+needs an API key or network access.
+"""
+import contextlib
+import functools
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Benchmarks measure the app, not the model: default to an instant stub unless overridden
+os.environ.setdefault("CHARACTER_AI_BACKEND", "stub")
+os.environ.setdefault("CHARACTER_AI_STUB_LATENCY", "0")
+os.environ.setdefault("CHARACTER_AI_STUB_CHUNK_DELAY", "0")
+os.environ.setdefault("CHARACTER_AI_RATE_LIMIT_RPM", "1000000") # Don't let the client-side limiter throttle the benchmark
+
+from streamlit.runtime.scriptrunner import script_runner  # noqa: E402
+from streamlit.testing.v1 import AppTest, local_script_runner  # noqa: E402
+
+
+def new_app(timeout=120, app_path=APP_PATH):
+    """A fresh AppTest session for app.py (not yet run)."""
+    return AppTest.from_file(app_path, default_timeout=timeout)
+
+
+class ScriptProbe:
+    """Records script execution time and forward-message bytes of each AppTest run.
+
+    AppTest's own wall time also includes building the element tree; the
+    probe times just ScriptRunner._run_script and sums the serialized size of
+    every message the script sends to the browser. It also notes which
+    fragment each widget was drawn by, for `run_fragment`.
+    """
+
+    def __init__(self):
+        self.script_seconds = []
+        self.bytes_sent = []
+        self.widget_fragments = {} # Widget id -> id of the fragment that drew it
+        self._current_bytes = 0
+
+    @contextlib.contextmanager
+    def attach(self):
+        original_run = script_runner.ScriptRunner._run_script
+        original_enqueue = script_runner.ScriptRunner._enqueue_forward_msg
+        probe = self
+
+        def timed_run(runner, rerun_data):
+            probe._current_bytes = 0
+            started_at = time.perf_counter()
+            try:
+                return original_run(runner, rerun_data)
+            finally:
+                probe.script_seconds.append(time.perf_counter() - started_at)
+                probe.bytes_sent.append(probe._current_bytes)
+
+        def counting_enqueue(runner, msg):
+            probe._current_bytes += msg.ByteSize()
+            if msg.WhichOneof("type") == "delta" and msg.delta.fragment_id:
+                element = msg.delta.new_element
+                kind = element.WhichOneof("type")
+                widget_id = getattr(getattr(element, kind), "id", None) if kind else None
+                if widget_id:
+                    probe.widget_fragments[widget_id] = msg.delta.fragment_id
+            return original_enqueue(runner, msg)
+
+        script_runner.ScriptRunner._run_script = timed_run
+        script_runner.ScriptRunner._enqueue_forward_msg = counting_enqueue
+        try:
+            yield self
+        finally:
+            script_runner.ScriptRunner._run_script = original_run
+            script_runner.ScriptRunner._enqueue_forward_msg = original_enqueue
+
+    def reset(self):
+        self.script_seconds.clear()
+        self.bytes_sent.clear()
+
+
+def run_fragment(at, widget, probe):
+    """Rerun only the fragment that drew `widget`, as the browser does after that widget changes.
+
+    AppTest itself always reruns the whole script. Afterwards `at` holds only
+    the fragment's elements, so run the full app again before touching
+    widgets outside it.
+    """
+    fragment_id = probe.widget_fragments[widget.id]
+    original_rerun_data = local_script_runner.RerunData
+    local_script_runner.RerunData = functools.partial(original_rerun_data, fragment_id_queue=[fragment_id])
+    try:
+        return widget.run()
+    finally:
+        local_script_runner.RerunData = original_rerun_data
+
+
+@contextlib.contextmanager
+def reuse_compiled_script():
+    """Compile app.py once for all runs, as a server does.
+
+    AppTest gives every run a fresh script cache, so each run (fragment
+    reruns included) would also pay for compiling the script again.
+    """
+    original_cache = local_script_runner.ScriptCache
+    shared_cache = original_cache()
+    local_script_runner.ScriptCache = lambda: shared_cache
+    try:
+        yield
+    finally:
+        local_script_runner.ScriptCache = original_cache
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100.0 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "n": len(values),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "mean": statistics.fmean(values),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment_info():
+    import streamlit
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "streamlit": streamlit.__version__,
+        "backend": os.environ.get("CHARACTER_AI_BACKEND"),
+    }
+
+
+def save_results(name, results, path=None):
+    """Write results as JSON (default: benchmarks/results/<name>-<git rev>.json) and return the path."""
+    payload = {"benchmark": name, "revision": git_revision(), "created_at": time.time(),
+               "environment": environment_info(), "results": results}
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{name}-{payload['revision']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
+    return path
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
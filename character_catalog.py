@@ -0,0 +1,184 @@
+"""Character catalog loaded from a data directory, with mtime-based hot reload.
+
+Every `*.json` (and, if PyYAML is installed, `*.yaml` / `*.yml`) file in the
+directory holds one category of characters:
+
+    {"category": "shy", "characters": [
+        {"name": "Leo (Shy) 🦁", "style": "You are Leo, ...", "intro": "Um... h-hello.",
+         "backstory": "...", "personality_type": "ISFP - The Adventurer"}
+    ]}
+
+`name` and `style` (the persona prompt) are required; `intro`, `backstory`,
+`personality_type` and a per-character `category` override are optional.
+Files are read in file-name order, which is also the order characters are
+listed in.
+
+`CharacterCatalog.registry()` stats the directory at most once per
+`check_interval` seconds and re-parses only files whose mtime or size
+changed. A file that fails validation is reported in `errors` and its last
+good version stays in use, so a half-saved edit never takes characters away
+from running sessions.
+"""
+import functools
+import json
+import os
+import threading
+import time
+
+from character_registry import CharacterRegistry
+
+CATALOG_DIR_ENV_VAR = "CHARACTER_AI_CATALOG_DIR"
+DEFAULT_CATALOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "characters")
+CHECK_INTERVAL = 2.0 # Seconds between directory scans
+JSON_SUFFIXES = (".json",)
+YAML_SUFFIXES = (".yaml", ".yml")
+REQUIRED_FIELDS = ("name", "style")
+OPTIONAL_FIELDS = ("intro", "backstory", "personality_type", "category")
+
+
+class CatalogError(ValueError):
+    """A catalog file that can't be parsed or doesn't match the schema."""
+
+
+def _load_yaml(text):
+    try:
+        import yaml # Optional: only needed for YAML catalog files
+    except ImportError:
+        raise CatalogError("PyYAML is not installed; use JSON or `pip install pyyaml`") from None
+    return yaml.safe_load(text)
+
+
+def parse_catalog_file(path):
+    """Parse and validate one catalog file into a list of character records."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        data = _load_yaml(text) if path.endswith(YAML_SUFFIXES) else json.loads(text)
+    except Exception as e:
+        raise CatalogError(f"{os.path.basename(path)}: {e}") from None
+    return validate_catalog(data, os.path.basename(path))
+
+
+def validate_catalog(data, source="<catalog>"):
+    if not isinstance(data, dict) or not isinstance(data.get("characters"), list):
+        raise CatalogError(f"{source}: expected an object with a 'characters' list")
+    default_category = data.get("category", os.path.splitext(source)[0])
+    if not isinstance(default_category, str) or not default_category:
+        raise CatalogError(f"{source}: 'category' must be a non-empty string")
+    records = []
+    for index, entry in enumerate(data["characters"]):
+        where = f"{source}: character #{index + 1}"
+        if not isinstance(entry, dict):
+            raise CatalogError(f"{where}: expected an object")
+        for field in REQUIRED_FIELDS:
+            if not isinstance(entry.get(field), str) or not entry[field].strip():
+                raise CatalogError(f"{where}: '{field}' is required and must be a non-empty string")
+        for field in OPTIONAL_FIELDS:
+            if entry.get(field) is not None and not isinstance(entry[field], str):
+                raise CatalogError(f"{where} ({entry['name']}): '{field}' must be a string")
+        unknown = set(entry) - set(REQUIRED_FIELDS) - set(OPTIONAL_FIELDS)
+        if unknown:
+            raise CatalogError(f"{where} ({entry['name']}): unknown field(s) {', '.join(sorted(unknown))}")
+        records.append({
+            "name": entry["name"],
+            "category": entry.get("category") or default_category,
+            "style": entry["style"],
+            "intro": entry.get("intro"),
+            "backstory": entry.get("backstory"),
+            "personality_type": entry.get("personality_type"),
+        })
+    return records
+
+
+class CharacterCatalog:
+    """Thread-safe, hot-reloading registry source for one data directory."""
+
+    def __init__(self, directory, check_interval=CHECK_INTERVAL, clock=time.monotonic):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.clock = clock
+        self.reloads = 0
+        self._files = {} # path -> (mtime_ns, size, records)
+        self._file_errors = {} # path -> validation error of its current version
+        self._merge_errors = []
+        self._registry = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def errors(self):
+        """Problems found in the current files, one string each."""
+        return [self._file_errors[path] for path in sorted(self._file_errors)] + self._merge_errors
+
+    def registry(self):
+        """The current registry, reloading changed files if the check interval has passed."""
+        now = self.clock()
+        if self._registry is not None and now - self._checked_at < self.check_interval:
+            return self._registry
+        with self._lock:
+            if self._registry is None or now - self._checked_at >= self.check_interval:
+                self._refresh()
+                self._checked_at = now
+            return self._registry
+
+    def reload(self):
+        """Scan the directory now, regardless of the check interval."""
+        with self._lock:
+            self._refresh()
+            self._checked_at = self.clock()
+            return self._registry
+
+    def _catalog_paths(self):
+        suffixes = JSON_SUFFIXES + YAML_SUFFIXES
+        with os.scandir(self.directory) as entries:
+            return sorted(entry.path for entry in entries if entry.is_file() and entry.name.endswith(suffixes))
+
+    def _refresh(self):
+        changed = self._registry is None
+        seen = set()
+        for path in self._catalog_paths():
+            seen.add(path)
+            stat = os.stat(path)
+            cached = self._files.get(path)
+            if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                continue
+            try:
+                records = parse_catalog_file(path)
+                self._file_errors.pop(path, None)
+            except CatalogError as e:
+                self._file_errors[path] = str(e)
+                records = cached[2] if cached is not None else [] # Keep serving the last good version
+            self._files[path] = (stat.st_mtime_ns, stat.st_size, records)
+            changed = True
+        for path in set(self._files) - seen:
+            del self._files[path]
+            self._file_errors.pop(path, None)
+            changed = True
+        if changed:
+            records, self._merge_errors = self._merge()
+            self._registry = CharacterRegistry(records)
+            self.reloads += 1
+
+    def _merge(self):
+        records = []
+        names = set()
+        errors = []
+        for path in sorted(self._files):
+            for record in self._files[path][2]:
+                if record["name"] in names:
+                    errors.append(f"{os.path.basename(path)}: duplicate character {record['name']!r} skipped")
+                    continue
+                names.add(record["name"])
+                records.append(record)
+        return records, errors
+
+
+@functools.lru_cache(maxsize=None)
+def get_catalog(directory=None):
+    """The process-wide catalog for `directory` (default: CHARACTER_AI_CATALOG_DIR or ./characters)."""
+    return CharacterCatalog(directory or os.environ.get(CATALOG_DIR_ENV_VAR) or DEFAULT_CATALOG_DIR)
+
+
+def get_registry():
+    """The current registry of the process-wide catalog; cheap enough to call on every rerun."""
+    return get_catalog().registry()
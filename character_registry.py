@@ -0,0 +1,156 @@
+"""Indexed, immutable view over the character catalog.
+
+Streamlit re-executes app.py on every interaction, so anything built at
+script level is rebuilt on every rerun. A registry is built once per catalog
+version (see `character_catalog.get_registry`) and gives O(1) lookups for
+everything the sidebar and chat need, plus a prefix search index for the
+character picker.
+"""
+import bisect
+import re
+
+CATEGORY_TAGS = ("(Shy)", "(Calm)", "(Angry)")
+FALLBACK_EMOJI = "🤖"
+DEFAULT_SEARCH_LIMIT = 50
+_TOKEN = re.compile(r"\w+")
+
+# How much a query term matching each field counts towards a character's rank
+SEARCH_FIELD_WEIGHTS = (
+    ("name", 8),
+    ("category", 4),
+    ("personality_type", 2),
+    ("backstory", 1),
+)
+
+
+def extract_emoji(name):
+    """Pick the avatar emoji out of names like "Luna 🌙" or "Leo (Shy) 🦁"."""
+    parts = name.split(" ")
+    if len(parts) > 1 and not parts[-1].isalnum() and parts[-1] not in CATEGORY_TAGS: # Last part is likely an emoji
+        return parts[-1]
+    if len(parts) > 2 and not parts[-2].isalnum() and parts[-2] not in CATEGORY_TAGS: # "Name (Category) EMOJI" variants
+        return parts[-2]
+    return parts[-1] if len(parts) > 1 and not parts[-1].isalnum() else FALLBACK_EMOJI
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+class Character:
+    """Everything the app needs about one character, precomputed."""
+
+    __slots__ = ("name", "category", "position", "emoji", "style", "intro", "details", "short_name")
+
+    def __init__(self, name, category, position, style, intro, details):
+        self.name = name
+        self.category = category
+        self.position = position # Index within its category
+        self.emoji = extract_emoji(name)
+        self.style = style
+        self.intro = intro
+        self.details = details
+        self.short_name = name.split(" ")[0]
+
+
+class SearchIndex:
+    """Prefix-matching inverted index over name, category, personality type and backstory.
+
+    Terms are kept in one sorted list, so each query term is a binary search
+    plus a scan over the terms it prefixes; cost depends on how many
+    characters match, not on how many exist. Every query term has to match
+    (AND); results are ranked by the weight of the best field each term hit,
+    exact terms beating prefixes, then by catalog order.
+    """
+
+    def __init__(self, records):
+        postings = {}
+        for position, record in enumerate(records):
+            for field, weight in SEARCH_FIELD_WEIGHTS:
+                for term in tokenize(record.get(field)):
+                    entry = postings.setdefault(term, {})
+                    if entry.get(position, 0) < weight:
+                        entry[position] = weight
+        self._terms = sorted(postings)
+        self._postings = [postings[term] for term in self._terms]
+
+    def _matches(self, prefix):
+        """Best score per position for one query term."""
+        scores = {}
+        index = bisect.bisect_left(self._terms, prefix)
+        while index < len(self._terms) and self._terms[index].startswith(prefix):
+            exact = self._terms[index] == prefix
+            for position, weight in self._postings[index].items():
+                score = weight * 2 if exact else weight
+                if scores.get(position, 0) < score:
+                    scores[position] = score
+            index += 1
+        return scores
+
+    def search(self, query):
+        """Positions matching every term of `query`, best first."""
+        totals = None
+        for term in sorted(set(tokenize(query)), key=len, reverse=True): # Longest (most selective) term first
+            scores = self._matches(term)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {position: total + scores[position] for position, total in totals.items() if position in scores}
+            if not totals:
+                return []
+        if totals is None:
+            return []
+        return sorted(totals, key=lambda position: (-totals[position], position))
+
+
+class CharacterRegistry:
+    """Immutable character index built from validated catalog records (in display order)."""
+
+    def __init__(self, records):
+        self.characters = {}
+        names_by_category = {}
+        for record in records:
+            name = record["name"]
+            category_names = names_by_category.setdefault(record["category"], [])
+            details = {field: record[field] for field in ("backstory", "personality_type") if record.get(field)}
+            self.characters[name] = Character(
+                name, record["category"], len(category_names),
+                style=record["style"],
+                intro=record.get("intro") or f"Hello, I am {name}. How can I help?",
+                details=details or None,
+            )
+            category_names.append(name)
+        self.names_by_category = {category: tuple(names) for category, names in names_by_category.items()}
+        self.categories = tuple(self.names_by_category)
+        self.names = tuple(self.characters)
+        self._index = SearchIndex(records)
+        # Flat dict views for code that only needs one field
+        self.category_of = {name: c.category for name, c in self.characters.items()}
+        self.emojis = {name: c.emoji for name, c in self.characters.items()}
+        self.styles = {name: c.style for name, c in self.characters.items()}
+        self.intros = {name: c.intro for name, c in self.characters.items()}
+        self.details = {name: c.details for name, c in self.characters.items() if c.details is not None}
+
+    def __contains__(self, name):
+        return name in self.characters
+
+    def __len__(self):
+        return len(self.characters)
+
+    def get(self, name):
+        return self.characters.get(name)
+
+    def search(self, query="", category=None, limit=DEFAULT_SEARCH_LIMIT):
+        """Names matching `query` (all names if empty), optionally within one category, best first."""
+        if query.strip():
+            names = (self.names[position] for position in self._index.search(query))
+        else:
+            names = iter(self.names_by_category.get(category, ()) if category else self.names)
+            category = None # Already filtered
+        results = []
+        for name in names:
+            if category is None or self.category_of[name] == category:
+                results.append(name)
+                if len(results) >= limit:
+                    break
+        return results
@@ -0,0 +1,140 @@
+"""Chat export (plain text, Markdown, JSONL) and JSONL import.
+
+Exports are produced as a stream of text chunks from any iterable of turns
+(anything with `role` and `content` attributes), so a saved conversation can be written out
+straight from the store in batches without first joining the whole
+transcript into one string. The app only builds an export when the download
+is actually requested.
+
+The JSONL format is one header line followed by one line per message:
+
+    {"type": "chat_export", "version": 1, "character": "...", "exported_at": 1700000000.0}
+    {"role": "assistant", "content": "..."}
+    {"role": "user", "content": "..."}
+
+`read_jsonl_export` parses it back; `pair_exchanges` turns the messages into
+the (user, model) pairs a ContextWindow is rebuilt from, so an imported chat
+continues without sending any of its turns through the model again.
+"""
+import io
+import json
+import time
+
+from transcript import USER, Turn
+
+EXPORT_TYPE = "chat_export"
+EXPORT_VERSION = 1
+ROLES = ("user", "assistant")
+
+# Format key -> (label, file extension, MIME type)
+EXPORT_FORMATS = {
+    "txt": ("Plain text", "txt", "text/plain"),
+    "md": ("Markdown", "md", "text/markdown"),
+    "jsonl": ("JSON lines", "jsonl", "application/x-ndjson"),
+}
+
+
+def short_name(character):
+    return character.split(" ")[0]
+
+
+def iter_text_export(messages, character):
+    char_display_name = short_name(character) # Use first part of name for AI
+    for index, msg in enumerate(messages):
+        if index:
+            yield "\n\n"
+        role = "You" if msg.role == USER else char_display_name
+        yield f"{role}: {msg.content}"
+
+
+def iter_markdown_export(messages, character):
+    yield f"# Chat with {character}\n"
+    char_display_name = short_name(character)
+    for msg in messages:
+        role = "You" if msg.role == USER else char_display_name
+        yield f"\n**{role}:**\n\n{msg.content}\n"
+
+
+def iter_jsonl_export(messages, character):
+    header = {"type": EXPORT_TYPE, "version": EXPORT_VERSION, "character": character, "exported_at": time.time()}
+    yield json.dumps(header, ensure_ascii=False) + "\n"
+    for msg in messages:
+        yield json.dumps({"role": msg.role, "content": msg.content}, ensure_ascii=False) + "\n"
+
+
+EXPORTERS = {
+    "txt": iter_text_export,
+    "md": iter_markdown_export,
+    "jsonl": iter_jsonl_export,
+}
+
+
+def iter_export(messages, character, fmt="txt"):
+    """Yield the export of `messages` in format `fmt` as text chunks."""
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown export format {fmt!r}; expected one of: {', '.join(EXPORTERS)}")
+    return EXPORTERS[fmt](messages, character)
+
+
+def export_file(messages, character, fmt="txt"):
+    """Encode the export chunk by chunk into a file object ready for download."""
+    buffer = io.BytesIO()
+    for chunk in iter_export(messages, character, fmt):
+        buffer.write(chunk.encode("utf-8"))
+    buffer.seek(0)
+    return buffer
+
+
+def export_file_name(character, fmt):
+    return f"chat_with_{short_name(character)}.{EXPORT_FORMATS[fmt][1]}"
+
+
+class ImportedChat:
+    __slots__ = ("character", "messages", "exported_at")
+
+    def __init__(self, character, messages, exported_at=None):
+        self.character = character
+        self.messages = messages
+        self.exported_at = exported_at
+
+
+def read_jsonl_export(lines):
+    """Parse a JSONL export from an iterable of lines (str or bytes). Raises ValueError if it isn't one."""
+    header = None
+    messages = []
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Line {line_number} is not valid JSON: {e}") from None
+        if header is None:
+            if not isinstance(record, dict) or record.get("type") != EXPORT_TYPE:
+                raise ValueError("Not a chat export: the first line must be the export header.")
+            if record.get("version") != EXPORT_VERSION:
+                raise ValueError(f"Unsupported export version {record.get('version')!r}.")
+            if not isinstance(record.get("character"), str):
+                raise ValueError("The export header has no character.")
+            header = record
+            continue
+        if (not isinstance(record, dict) or record.get("role") not in ROLES
+                or not isinstance(record.get("content"), str)):
+            raise ValueError(f"Line {line_number} is not a chat message.")
+        messages.append(Turn(record["role"], record["content"]))
+    if header is None:
+        raise ValueError("The file is empty.")
+    return ImportedChat(header["character"], messages, header.get("exported_at"))
+
+
+def pair_exchanges(messages):
+    """Yield `(user_text, assistant_text)` pairs, skipping the intro and unanswered user messages."""
+    pending_user = None
+    for msg in messages:
+        if msg.role == USER:
+            pending_user = msg.content
+        elif pending_user is not None:
+            yield pending_user, msg.content
+            pending_user = None
@@ -0,0 +1,205 @@
+"""Token-budgeted chat context: persona + running summary + the last N exchanges.
+
+Instead of letting the chat session replay the whole conversation on every
+turn, the app rebuilds the history from a ContextWindow before each send.
+The persona and intro form a static system instruction (so backends can
+cache that prefix); once the replayed history goes over the token budget,
+the oldest exchanges are folded into a short running summary that leads the
+history. Folded exchanges stay in a long-term memory index, and the few that
+best match the new message are recalled into the history for that send.
+"""
+import re
+
+from long_term_memory import ConversationMemory
+
+CHARS_PER_TOKEN = 4 # Rough average for English text; good enough for budgeting
+SUMMARY_HEADER = "Summary of the conversation so far (stay consistent with it):"
+SUMMARY_ACK = "Understood."
+RECALL_HEADER = "Earlier moments from this conversation that may be relevant:"
+INTRO_NOTE = 'You opened this conversation by saying: "{intro}"'
+
+
+def estimate_tokens(text):
+    """Cheap offline token estimate used when no tokenizer is supplied."""
+    if not text:
+        return 0
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def _first_sentence(text, max_chars=160):
+    text = " ".join(text.split())
+    sentence = _SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars - 1].rstrip() + "…"
+    return sentence
+
+
+def summarize_exchanges(previous_summary, exchanges):
+    """Extractive summary: keep the lead sentence of each folded message.
+
+    `exchanges` is a list of (user_text, model_text) pairs. Runs locally so
+    folding never costs an extra model call.
+    """
+    lines = [previous_summary] if previous_summary else []
+    for user_text, model_text in exchanges:
+        lines.append(f"- User: {_first_sentence(user_text)} / You: {_first_sentence(model_text)}")
+    return "\n".join(lines)
+
+
+class ContextWindow:
+    """Keeps the persona (as a system instruction) and the last `keep_last` exchanges verbatim.
+
+    Older exchanges are folded into `summary` whenever the replayed history
+    would exceed `token_budget`. `full_tokens` tracks what the unmanaged chat
+    session would have resent, so the savings can be reported per turn.
+    Up to `recall_k` folded exchanges matching the message being sent are
+    recalled on top of the budget; each snippet is clipped, so that part of
+    the prompt has a fixed upper bound.
+    """
+
+    def __init__(self, persona, intro, token_budget=2000, keep_last=6, recall_k=3,
+                 max_summary_tokens=400, count_tokens=estimate_tokens, summarize=summarize_exchanges):
+        self.persona = persona
+        self.intro = intro
+        self.token_budget = token_budget
+        self.keep_last = keep_last
+        self.recall_k = recall_k
+        self.max_summary_tokens = max_summary_tokens
+        self.count_tokens = count_tokens
+        self.summarize = summarize
+        self.summary = ""
+        self.exchanges = [] # (user_text, model_text, tokens) still replayed verbatim
+        self.folded_exchanges = 0
+        self.memory = ConversationMemory() # Every exchange, including folded ones
+        self._recalled = (None, 0, 0, []) # (query, folded_exchanges, recall_k, snippets) of the last recall
+        self._system_instruction = f"{persona}\n\n{INTRO_NOTE.format(intro=intro)}"
+        self._base_tokens = count_tokens(self._system_instruction)
+        self._exchange_tokens = 0
+        self._summary_tokens = 0
+        self.full_tokens = self._base_tokens # What the full, unsummarized history would cost
+
+    def to_dict(self):
+        """JSON-serializable state, for writing an idle session to disk."""
+        return {
+            "persona": self.persona, "intro": self.intro, "token_budget": self.token_budget,
+            "keep_last": self.keep_last, "recall_k": self.recall_k, "max_summary_tokens": self.max_summary_tokens,
+            "summary": self.summary,
+            "exchanges": [[user_text, model_text, tokens] for user_text, model_text, tokens in self.exchanges],
+            "folded_exchanges": self.folded_exchanges, "full_tokens": self.full_tokens,
+            "memory": [[user_text, model_text] for user_text, model_text in self.memory.exchanges[:self.folded_exchanges]],
+        }
+
+    @classmethod
+    def from_dict(cls, data, count_tokens=estimate_tokens, summarize=summarize_exchanges):
+        """Rebuild a window saved with `to_dict`."""
+        window = cls(data["persona"], data["intro"], token_budget=data["token_budget"], keep_last=data["keep_last"],
+                     recall_k=data.get("recall_k", 3), max_summary_tokens=data["max_summary_tokens"],
+                     count_tokens=count_tokens, summarize=summarize)
+        window._set_summary(data["summary"])
+        for user_text, model_text in data.get("memory", []):
+            window.memory.add(user_text, model_text)
+        window.exchanges = [(user_text, model_text, tokens) for user_text, model_text, tokens in data["exchanges"]]
+        window._exchange_tokens = sum(tokens for _, _, tokens in window.exchanges)
+        for user_text, model_text, _ in window.exchanges:
+            window.memory.add(user_text, model_text)
+        window.folded_exchanges = data["folded_exchanges"]
+        window.full_tokens = data["full_tokens"]
+        return window
+
+    def configure(self, token_budget=None, keep_last=None, recall_k=None):
+        """Apply new limits; takes effect on the next compaction."""
+        if token_budget is not None:
+            self.token_budget = token_budget
+        if keep_last is not None:
+            self.keep_last = keep_last
+        if recall_k is not None:
+            self.recall_k = recall_k
+        self.compact()
+
+    @property
+    def history_tokens(self):
+        """Estimated tokens of the history that will actually be replayed."""
+        return self._base_tokens + self._summary_tokens + self._exchange_tokens
+
+    def system_instruction(self):
+        """Static per-character prefix: persona plus the intro the user saw."""
+        return self._system_instruction
+
+    def recall(self, query):
+        """Snippets of the folded exchanges that best match `query` (exchanges still replayed are skipped)."""
+        key = (query, self.folded_exchanges, self.recall_k)
+        if self._recalled[:3] != key:
+            snippets = self.memory.snippets(query, k=self.recall_k, before=self.folded_exchanges) if query else []
+            self._recalled = key + (snippets,)
+        return self._recalled[3]
+
+    def build_history(self, query=None, without_last=False):
+        """History in the `start_chat` / `ChatSession.history` format (without the system instruction).
+
+        With `query` (the message about to be sent), relevant folded exchanges
+        are recalled after the summary. `without_last` leaves out the newest
+        exchange, to ask for that reply again.
+        """
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [f"{SUMMARY_HEADER}\n{self.summary}"]})
+            history.append({"role": "model", "parts": [SUMMARY_ACK]})
+        snippets = self.recall(query)
+        if snippets:
+            history.append({"role": "user", "parts": [RECALL_HEADER + "\n" + "\n".join(snippets)]})
+            history.append({"role": "model", "parts": [SUMMARY_ACK]})
+        for user_text, model_text, _ in (self.exchanges[:-1] if without_last else self.exchanges):
+            history.append({"role": "user", "parts": [user_text]})
+            history.append({"role": "model", "parts": [model_text]})
+        return history
+
+    def prompt_tokens(self, user_input):
+        """Return `(managed, full)` estimated prompt tokens for sending `user_input`."""
+        input_tokens = self.count_tokens(user_input)
+        snippets = self.recall(user_input)
+        recall_tokens = self.count_tokens(RECALL_HEADER + "\n" + "\n".join(snippets)) + self.count_tokens(SUMMARY_ACK) if snippets else 0
+        return self.history_tokens + recall_tokens + input_tokens, self.full_tokens + input_tokens
+
+    def add_exchange(self, user_text, model_text):
+        tokens = self.count_tokens(user_text) + self.count_tokens(model_text)
+        self.exchanges.append((user_text, model_text, tokens))
+        self.memory.add(user_text, model_text)
+        self._exchange_tokens += tokens
+        self.full_tokens += tokens
+        self.compact()
+
+    def replace_last_reply(self, model_text):
+        """Swap the reply of the newest exchange, e.g. for a regenerated one the user picked."""
+        user_text, _, old_tokens = self.exchanges[-1]
+        tokens = self.count_tokens(user_text) + self.count_tokens(model_text)
+        self.exchanges[-1] = (user_text, model_text, tokens)
+        self.memory.replace_last(user_text, model_text)
+        self._exchange_tokens += tokens - old_tokens
+        self.full_tokens += tokens - old_tokens
+        self.compact()
+
+    def compact(self):
+        """Fold the oldest exchanges into the summary while over budget."""
+        if self.history_tokens <= self.token_budget or len(self.exchanges) <= self.keep_last:
+            return
+        to_fold = []
+        while len(self.exchanges) > self.keep_last and self.history_tokens > self.token_budget:
+            user_text, model_text, tokens = self.exchanges.pop(0)
+            self._exchange_tokens -= tokens
+            to_fold.append((user_text, model_text))
+        self.folded_exchanges += len(to_fold)
+        self._set_summary(self.summarize(self.summary, to_fold))
+
+    def _set_summary(self, summary):
+        # Keep the running summary bounded by dropping its oldest lines first
+        lines = summary.split("\n")
+        while len(lines) > 1 and self.count_tokens("\n".join(lines)) > self.max_summary_tokens:
+            lines.pop(0)
+        self.summary = "\n".join(lines)
+        if self.summary:
+            self._summary_tokens = self.count_tokens(f"{SUMMARY_HEADER}\n{self.summary}") + self.count_tokens(SUMMARY_ACK)
+        else:
+            self._summary_tokens = 0
@@ -0,0 +1,185 @@
+"""Append-only SQLite store for conversations, keyed by user and character.
+
+Turns are inserted one at a time as they happen. The only rewrite is swapping
+the newest reply for a regenerated one the user picked.
+Reads are paged from the newest turn backwards so the UI never has to pull a
+whole transcript into memory, and `iter_exchanges` streams a conversation
+back out to rebuild a chat session on resume.
+"""
+import sqlite3
+import threading
+import time
+
+from transcript import Turn
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    character TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS conversations_by_user_character ON conversations (user_id, character, id);
+CREATE TABLE IF NOT EXISTS turns (
+    conversation_id INTEGER NOT NULL REFERENCES conversations (id),
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (conversation_id, seq)
+);
+"""
+
+
+class StoredTurn:
+    __slots__ = ("seq", "role", "content", "created_at")
+
+    def __init__(self, seq, role, content, created_at):
+        self.seq = seq
+        self.role = role
+        self.content = content
+        self.created_at = created_at
+
+    def as_turn(self):
+        return Turn(self.role, self.content)
+
+
+class ConversationStore:
+    """Thread-safe wrapper around one SQLite connection (WAL mode)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def create_conversation(self, user_id, character):
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO conversations (user_id, character, created_at) VALUES (?, ?, ?)",
+                (user_id, character, time.time()),
+            )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def latest_conversation(self, user_id, character):
+        """Id of the most recent conversation for this user and character, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id FROM conversations WHERE user_id = ? AND character = ? ORDER BY id DESC LIMIT 1",
+                (user_id, character),
+            ).fetchone()
+        return row[0] if row else None
+
+    def append_turn(self, conversation_id, role, content):
+        """Append one turn and return its sequence number."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM turns WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            seq = row[0]
+            self._db.execute(
+                "INSERT INTO turns (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, seq, role, content, time.time()),
+            )
+            self._db.commit()
+            return seq
+
+    def append_turns(self, conversation_id, turns):
+        """Append turns in one transaction (e.g. an imported chat); returns how many."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM turns WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            now = time.time()
+            rows = [(conversation_id, seq, turn.role, turn.content, now)
+                    for seq, turn in enumerate(turns, start=row[0])]
+            self._db.executemany(
+                "INSERT INTO turns (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._db.commit()
+            return len(rows)
+
+    def replace_last_turn(self, conversation_id, role, content):
+        """Replace the content of the newest turn if it has `role`; returns whether it did."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE turns SET content = ?, created_at = ? WHERE conversation_id = ? AND role = ? "
+                "AND seq = (SELECT MAX(seq) FROM turns WHERE conversation_id = ?)",
+                (content, time.time(), conversation_id, role, conversation_id),
+            )
+            self._db.commit()
+            return cursor.rowcount == 1
+
+    def count_turns(self, conversation_id):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM turns WHERE conversation_id = ?", (conversation_id,)).fetchone()[0]
+
+    def load_page(self, conversation_id, before_seq=None, limit=50):
+        """Up to `limit` turns older than `before_seq` (newest page if None), oldest first."""
+        query = "SELECT seq, role, content, created_at FROM turns WHERE conversation_id = ?"
+        params = [conversation_id]
+        if before_seq is not None:
+            query += " AND seq < ?"
+            params.append(before_seq)
+        query += " ORDER BY seq DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [StoredTurn(*row) for row in reversed(rows)]
+
+    def has_turns_before(self, conversation_id, seq):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM turns WHERE conversation_id = ? AND seq < ? LIMIT 1", (conversation_id, seq)
+            ).fetchone()
+        return row is not None
+
+    def iter_turns(self, conversation_id, batch_size=200):
+        """Yield every turn oldest first, reading `batch_size` rows at a time."""
+        after_seq = -1
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT seq, role, content, created_at FROM turns WHERE conversation_id = ? AND seq > ? "
+                    "ORDER BY seq LIMIT ?",
+                    (conversation_id, after_seq, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield StoredTurn(*row)
+            after_seq = rows[-1][0]
+
+    def iter_exchanges(self, conversation_id):
+        """Yield `(user_text, assistant_text)` pairs, skipping user turns that never got a reply."""
+        pending_user = None
+        for turn in self.iter_turns(conversation_id):
+            if turn.role == "user":
+                pending_user = turn.content
+            elif pending_user is not None:
+                yield pending_user, turn.content
+                pending_user = None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def resume_conversation(store, user_id, character, intro, context_window, page_size=50, start_new=False):
+    """Open (or start) the user's conversation with `character`.
+
+    Replays stored exchanges into `context_window` so the chat session can be
+    rebuilt from it, and returns `(conversation_id, newest_page)`.
+    """
+    conversation_id = None if start_new else store.latest_conversation(user_id, character)
+    if conversation_id is None:
+        conversation_id = store.create_conversation(user_id, character)
+        store.append_turn(conversation_id, "assistant", intro)
+    else:
+        for user_text, model_text in store.iter_exchanges(conversation_id):
+            context_window.add_exchange(user_text, model_text)
+    return conversation_id, store.load_page(conversation_id, limit=page_size)
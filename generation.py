@@ -0,0 +1,166 @@
+"""Reply generation on a background worker pool, with deadlines and cancellation.
+
+Calling the backend inside the script run meant a slow reply held the run
+until it finished, even after the user had switched character or cleared the
+chat, and nothing bounded how long a turn could take. Each reply is now a
+GenerationJob on a shared thread pool. The script waits for it in short slices
+(rendering streamed text as it arrives), which gives Streamlit a chance to stop
+the run when the user sends another message, switches character or clears the
+chat; the job is then cancelled. Those controls must rerun the whole app:
+Streamlit doesn't stop a running script for a fragment rerun. A job past its
+deadline is cancelled as timed out, and the backend call is given the
+remaining time as its own timeout.
+
+Cancellation is cooperative: the work checks `job.check()` between steps
+(before each attempt, between streamed chunks, before committing the reply),
+so a cancelled stream stops reading and its reply is never recorded. A blocking
+call already in flight can't be interrupted, but its result is dropped.
+"""
+import os
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+DEFAULT_TIMEOUT = 60.0
+DEFAULT_MAX_WORKERS = 16
+POLL_INTERVAL = 0.05 # How often a waiting script renders progress (and can be stopped)
+
+
+class GenerationCancelled(Exception):
+    def __init__(self, reason):
+        super().__init__(f"Reply cancelled ({reason}).")
+        self.reason = reason
+
+
+class GenerationTimeout(Exception):
+    """Not a TimeoutError on purpose: the retry policy must not retry a request that ran out of time."""
+
+    def __init__(self, timeout):
+        super().__init__(f"No reply within {timeout:g}s.")
+        self.timeout = timeout
+
+
+class GenerationJob:
+    """One reply being generated; `parts` holds the streamed text so far."""
+
+    def __init__(self, timeout, metrics=None, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.deadline = clock() + timeout
+        self.metrics = metrics
+        self.parts = []
+        self.timing = None # streaming.TurnTiming, if the work streams
+        self.usage = None # Token usage reported by the backend
+        self.notice = None # Status for the UI, e.g. a pending retry; set from the worker thread
+        self.hedge = None # How a hedged request went (hedging.Hedger.call)
+        self.cancel_reason = None
+        self.future = None
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        return max(0.0, self.deadline - self.clock())
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def cancel(self, reason):
+        """Ask the work to stop; returns False if it already finished or was cancelled."""
+        with self._lock:
+            if self.cancel_reason is not None or self.done():
+                return False
+            self.cancel_reason = reason
+        if self.future is not None:
+            self.future.cancel() # Still queued: never starts
+        if self.metrics is not None:
+            self.metrics.add(**({"timeouts": 1} if reason == "timeout" else {"cancellations": 1}))
+        return True
+
+    def check(self):
+        """Raise GenerationTimeout / GenerationCancelled if the job should stop; call between steps of the work."""
+        if self.cancel_reason is None and self.clock() >= self.deadline:
+            self.cancel("timeout")
+        if self.cancel_reason == "timeout":
+            raise GenerationTimeout(self.timeout)
+        if self.cancel_reason is not None:
+            raise GenerationCancelled(self.cancel_reason)
+
+    def add_chunk(self, text):
+        self.check()
+        self.parts.append(text)
+
+    def partial_text(self):
+        return "".join(self.parts)
+
+    def wait(self, on_poll=None, poll_interval=POLL_INTERVAL):
+        """Return the job's result, calling `on_poll(job)` between short waits.
+
+        Raises GenerationTimeout once the deadline passes. If the wait is cut
+        short (e.g. Streamlit stops the script for a rerun), the job is cancelled.
+        """
+        finished = False
+        try:
+            while True:
+                try:
+                    result = self.future.result(timeout=min(poll_interval, self.remaining()))
+                except CancelledError:
+                    self.check() # Cancelled before it started; raise the matching error
+                    raise
+                except FutureTimeoutError:
+                    self.check()
+                    if on_poll is not None:
+                        on_poll(self)
+                    continue
+                finished = True
+                return result
+        finally:
+            if not finished:
+                self.cancel("interrupted")
+
+
+def gather(jobs, on_poll=None, poll_interval=POLL_INTERVAL):
+    """Wait for every job; return each one's result, or the exception it raised, in order.
+
+    The jobs run concurrently, so this takes about as long as the slowest one.
+    `on_poll(job)` is called between short waits, as in `GenerationJob.wait`.
+    If the wait is cut short, the jobs still running are cancelled.
+    """
+    results = []
+    try:
+        for job in jobs:
+            try:
+                results.append(job.wait(on_poll=on_poll, poll_interval=poll_interval))
+            except Exception as e:
+                results.append(e)
+    finally:
+        for job in jobs[len(results):]:
+            job.cancel("interrupted")
+    return results
+
+
+class GenerationWorker:
+    """Shared thread pool that runs `fn(job)` for each submitted reply."""
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT, metrics=None, clock=time.monotonic):
+        self.timeout = timeout
+        self.metrics = metrics
+        self.clock = clock
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+
+    @classmethod
+    def from_env(cls, metrics=None, environ=os.environ):
+        return cls(
+            max_workers=int(environ.get("CHARACTER_AI_GENERATION_WORKERS") or DEFAULT_MAX_WORKERS),
+            timeout=float(environ.get("CHARACTER_AI_REQUEST_TIMEOUT") or DEFAULT_TIMEOUT),
+            metrics=metrics,
+        )
+
+    def submit(self, fn, timeout=None):
+        job = GenerationJob(self.timeout if timeout is None else timeout, metrics=self.metrics, clock=self.clock)
+        job.future = self._pool.submit(self._run, fn, job)
+        return job
+
+    @staticmethod
+    def _run(fn, job):
+        job.check() # Cancelled or out of time while queued
+        return fn(job)
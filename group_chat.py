@@ -0,0 +1,118 @@
+"""Group chat: send one user message to several characters concurrently.
+
+Each member keeps its own model and context window. `fan_out` runs the sends
+as jobs on a generation worker and yields results as they finish, so the
+caller can render fast replies while slow ones are still generating and the
+whole turn takes about as long as the slowest member, up to a shared deadline.
+"""
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import as_completed
+
+from context_window import ContextWindow
+from generation import GenerationTimeout, GenerationWorker
+
+MAX_GROUP_WORKERS = 8
+
+
+class GroupMember:
+    """One character in a group chat, with its own session and context.
+
+    `model_for` maps the member's context window to a model handle; the
+    persona is the model's system instruction, so each member needs its own.
+    Pass `context_window` to continue an earlier conversation.
+    """
+
+    def __init__(self, name, model_for, persona, intro, token_budget=2000, keep_last=6, recall_k=3, context_window=None):
+        self.name = name
+        self.context_window = context_window or ContextWindow(persona, intro, token_budget=token_budget,
+                                                              keep_last=keep_last, recall_k=recall_k)
+        self.model = model_for(self.context_window)
+        self.last_usage = {}
+
+    def switch_model(self, model):
+        """Continue this member's conversation on a different model / generation config."""
+        self.model = model
+
+    def send(self, text, job=None):
+        """Blocking send; safe to call from a worker thread.
+
+        Each send starts a chat from the context window, so a send that was
+        abandoned but is still running never shares a chat with a newer one.
+        With a GenerationJob, the request gets the job's remaining time and a
+        cancelled or late reply isn't recorded.
+        """
+        if job is not None:
+            job.check()
+        chat = self.model.start_chat(history=self.context_window.build_history(text))
+        reply_text = chat.send_message(text, timeout=job.remaining() if job is not None else None).text.strip()
+        if job is not None:
+            job.check()
+        self.last_usage = chat.last_usage
+        self.context_window.add_exchange(text, reply_text)
+        return reply_text
+
+
+class MemberResult:
+    __slots__ = ("name", "text", "error", "elapsed", "usage", "history_messages")
+
+    def __init__(self, name, text=None, error=None, elapsed=0.0, usage=None, history_messages=0):
+        self.name = name
+        self.text = text
+        self.error = error
+        self.elapsed = elapsed
+        self.usage = usage or {}
+        self.history_messages = history_messages
+
+
+def _timed_send(member, text, call, job):
+    history_messages = len(member.context_window.build_history(text))
+    started_at = time.perf_counter()
+    try:
+        if call is not None:
+            reply_text = call(lambda: member.send(text, job), check=job.check, remaining=job.remaining)
+        else:
+            reply_text = member.send(text, job)
+        return MemberResult(member.name, text=reply_text, elapsed=time.perf_counter() - started_at,
+                            usage=member.last_usage, history_messages=history_messages)
+    except Exception as e:
+        return MemberResult(member.name, error=e, elapsed=time.perf_counter() - started_at,
+                            history_messages=history_messages)
+
+
+def fan_out(members, text, call=None, worker=None, timeout=None):
+    """Send `text` to every member concurrently, yielding MemberResults as they complete.
+
+    `call`, if given, wraps each send (e.g. `ResilientCaller.call`) and is
+    passed the send's job as `check=job.check, remaining=job.remaining`. Errors are
+    returned on the result rather than raised, so one failing character
+    doesn't hide the others' replies. Sends share one deadline, `timeout`
+    seconds (default: the worker's); members still generating then come back
+    with a GenerationTimeout. If the caller stops iterating early, the
+    remaining sends are cancelled.
+    """
+    if not members:
+        return
+    if worker is None:
+        worker = GenerationWorker(max_workers=min(MAX_GROUP_WORKERS, len(members)))
+    jobs = {}
+    for member in members:
+        job = worker.submit(lambda job, member=member: _timed_send(member, text, call, job), timeout=timeout)
+        jobs[job.future] = (member, job)
+    pending = set(jobs)
+    try:
+        try:
+            for future in as_completed(jobs, timeout=min(job.remaining() for _, job in jobs.values())):
+                pending.discard(future)
+                yield future.result()
+        except FutureTimeoutError:
+            for future in list(pending):
+                pending.discard(future)
+                member, job = jobs[future]
+                if job.cancel("timeout") or not future.done():
+                    yield MemberResult(member.name, error=GenerationTimeout(job.timeout), elapsed=job.timeout)
+                else:
+                    yield future.result() # Finished right at the deadline
+    finally:
+        for future in pending:
+            jobs[future][1].cancel("interrupted")
@@ -0,0 +1,215 @@
+"""Hedged requests: send a duplicate when the first one is slow, keep whichever answers first.
+
+Gemini's tail latency is spiky: most replies start quickly, a few take many
+times longer for no reason the request can see. With hedging on, a request
+that hasn't started answering within the p95 of recent first-response
+latencies (first chunk when streaming, the whole reply otherwise) is sent a
+second time, and the reply that starts first wins. The other one is
+cancelled at its next check, and its text is never shown or recorded.
+
+Latencies are kept per key (model and streamed or not), and nothing is hedged
+until a key has `min_samples` of them. Hedges are capped at `max_hedge_rate`
+of requests, so a backend that is slow across the board doesn't get every
+request twice. A duplicate is a request like any other: it takes a token from
+the rate limiter, and it is only sent while the circuit breaker is closed and
+a token is free right away, so hedging never queues behind the limiter or
+adds load to a backend that is failing. The duplicates run on their own small
+pool, not the generation worker's, so a job waiting on its attempts never
+waits for a pool slot held by another waiting job.
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from generation import POLL_INTERVAL, GenerationCancelled
+
+HEDGE_PERCENTILE = 95
+LATENCY_WINDOW = 200 # Recent first-response latencies per key
+MIN_SAMPLES = 20 # Latencies needed before a key is hedged
+MIN_HEDGE_DELAY = 0.25 # Seconds; never hedge sooner than this
+MAX_HEDGE_RATE = 0.1 # Share of requests that may get a hedge
+DEFAULT_MAX_WORKERS = 32
+LOST_RACE = "another request answered first"
+
+
+class HedgedAttempt:
+    """One of the racing requests, passed to the work in place of the GenerationJob.
+
+    It behaves like the job (`check`, `add_chunk`, `remaining`, `parts`,
+    `timing`, `usage`), but `check` also stops it once another attempt has
+    won. The winner's streamed parts become the job's, so the UI shows its text.
+    """
+
+    def __init__(self, race, index, timeout):
+        self.race = race
+        self.job = race.job
+        self.index = index
+        self.started_at = race.clock()
+        self.deadline = None if timeout is None else self.started_at + timeout
+        self.parts = []
+        self.timing = None
+        self.usage = None
+
+    def remaining(self):
+        remaining = self.job.remaining()
+        if self.deadline is None:
+            return remaining
+        return max(0.0, min(remaining, self.deadline - self.race.clock()))
+
+    def check(self):
+        self.job.check()
+        if self.race.winner not in (None, self):
+            raise GenerationCancelled(LOST_RACE)
+
+    def add_chunk(self, text):
+        self.check()
+        self.race.claim(self)
+        self.parts.append(text)
+        self.job.parts = self.parts # A retry inside the attempt starts a new list
+
+    def partial_text(self):
+        return "".join(self.parts)
+
+
+class _Race:
+    def __init__(self, hedger, job, key):
+        self.hedger = hedger
+        self.job = job
+        self.key = key
+        self.clock = hedger.clock
+        self.winner = None
+        self._lock = threading.Lock()
+
+    def claim(self, attempt):
+        """Make `attempt` the winner if no other attempt has answered yet; raise GenerationCancelled if one has."""
+        with self._lock:
+            first = self.winner is None
+            if first:
+                self.winner = attempt
+        if first:
+            self.hedger.record(self.key, self.clock() - attempt.started_at)
+        elif self.winner is not attempt:
+            raise GenerationCancelled(LOST_RACE)
+
+
+def _run_attempt(fn, attempt):
+    result = fn(attempt)
+    attempt.race.claim(attempt) # A reply that wasn't streamed answers when it's complete
+    return result
+
+
+class Hedger:
+    """Process-wide latency tracker and hedging policy, shared by every session."""
+
+    def __init__(self, percentile=HEDGE_PERCENTILE, min_samples=MIN_SAMPLES, window=LATENCY_WINDOW,
+                 min_delay=MIN_HEDGE_DELAY, max_hedge_rate=MAX_HEDGE_RATE, max_workers=DEFAULT_MAX_WORKERS,
+                 clock=time.monotonic):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.max_hedge_rate = max_hedge_rate
+        self.clock = clock
+        self._latencies = {}
+        self._requests = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            percentile=float(environ.get("CHARACTER_AI_HEDGE_PERCENTILE") or HEDGE_PERCENTILE),
+            max_hedge_rate=float(environ.get("CHARACTER_AI_HEDGE_MAX_RATE") or MAX_HEDGE_RATE),
+        )
+
+    def record(self, key, seconds):
+        with self._lock:
+            samples = self._latencies.get(key)
+            if samples is None:
+                samples = self._latencies[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def hedge_after(self, key):
+        """Seconds to wait for a first response before hedging, or None while `key` has too few samples."""
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, samples[min(len(samples) - 1, int(self.percentile / 100.0 * len(samples)))])
+
+    def _take_hedge_budget(self, limiter=None, breaker=None):
+        if breaker is not None and breaker.state != breaker.CLOSED:
+            return False
+        with self._lock:
+            if self._hedges >= self.max_hedge_rate * self._requests:
+                return False
+            if limiter is not None and not limiter.try_acquire():
+                return False # Throttling: the duplicate would wait its turn and take another request's
+            self._hedges += 1
+            return True
+
+    def call(self, job, key, fn, timeout=None, limiter=None, breaker=None):
+        """Return `fn(attempt)` from the first of up to two attempts to respond.
+
+        `job` is the GenerationJob the call runs in; `timeout` limits each
+        attempt on top of the job's deadline. An attempt that fails before
+        anything arrived leaves the race to the other one; the error is raised
+        only if no attempt succeeds. The duplicate is only sent if `breaker`
+        is closed and `limiter` has a token free now. Sets `job.hedge` to
+        `{"delay", "hedged", "winner"}` (winner 1 is the duplicate).
+        """
+        with self._lock:
+            self._requests += 1
+        race = _Race(self, job, key)
+        delay = self.hedge_after(key)
+        job.hedge = {"delay": delay, "hedged": False, "winner": None}
+        attempts = {}
+
+        def start(index):
+            attempt = HedgedAttempt(race, index, timeout)
+            attempts[self._pool.submit(_run_attempt, fn, attempt)] = attempt
+
+        start(0)
+        hedge_at = None if delay is None else race.clock() + delay
+        errors = []
+        try:
+            while attempts:
+                if hedge_at is not None and (race.winner is not None or race.clock() >= hedge_at):
+                    hedge_at = None # Answering already, or time to hedge: either way, no more waiting for it
+                    if race.winner is None and self._take_hedge_budget(limiter, breaker):
+                        job.hedge["hedged"] = True
+                        start(1)
+                poll = POLL_INTERVAL if hedge_at is None else min(POLL_INTERVAL, max(0.0, hedge_at - race.clock()))
+                done, _ = wait(list(attempts), timeout=poll, return_when=FIRST_COMPLETED)
+                job.check()
+                for future in done:
+                    attempt = attempts.pop(future)
+                    try:
+                        result = future.result()
+                    except GenerationCancelled as e:
+                        if e.reason != LOST_RACE:
+                            errors.append(e)
+                        continue
+                    except Exception as e:
+                        if race.winner is attempt: # Failed after it had started answering: no one else is left to
+                            raise
+                        errors.append(e)
+                        continue
+                    job.timing, job.usage, job.parts = attempt.timing, attempt.usage, attempt.parts
+                    job.hedge["winner"] = attempt.index
+                    if attempt.index:
+                        with self._lock:
+                            self._hedge_wins += 1
+                    return result
+            raise errors[0]
+        finally:
+            if race.winner is None:
+                race.winner = race # Nobody won (an error or the job stopped): every attempt still running stops
+
+    def stats(self):
+        with self._lock:
+            return {"requests": self._requests, "hedges": self._hedges, "hedge_wins": self._hedge_wins}
@@ -0,0 +1,512 @@
+"""Pluggable LLM backends behind one small chat interface.
+
+The app only talks to three kinds of object:
+
+- a backend (`configure`, `create_model`, `count_tokens`)
+- a model handle from `create_model` (`start_chat(history)`, `expired()`)
+- a chat handle from `start_chat` (`history`, `send_message`, `stream_message`)
+
+History uses the `{"role": "user" | "model", "parts": [text]}` format that
+`start_chat` already accepted. The character persona is not part of that
+history: it is the model's `system_instruction`, so a model handle is
+specific to one model name + generation config + persona, and the static
+prefix can be cached by the backend and shared by every session that talks
+to the same character. `GeminiBackend` wraps google-generativeai;
+`StubBackend` produces deterministic replies offline so the app can be
+load-tested and benchmarked without a key or network.
+
+Pick the backend with the CHARACTER_AI_BACKEND env var ("gemini" or "stub").
+The stub is tuned with CHARACTER_AI_STUB_LATENCY, CHARACTER_AI_STUB_CHUNK_DELAY
+(seconds), CHARACTER_AI_STUB_CHUNK_WORDS, CHARACTER_AI_STUB_REPLY_WORDS and
+CHARACTER_AI_STUB_PREFILL_PER_1K (seconds per 1000 uncached prompt tokens);
+CHARACTER_AI_STUB_SLOW_RATE and CHARACTER_AI_STUB_SLOW_FACTOR add a latency tail.
+Set CHARACTER_AI_PREFIX_CACHE=0 to turn prompt-prefix caching off.
+"""
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from context_window import estimate_tokens
+from streaming import iter_chunk_text
+
+BACKEND_ENV_VAR = "CHARACTER_AI_BACKEND"
+DEFAULT_BACKEND = "gemini"
+MODEL_POOL_SIZE = 128 # Model handles kept per backend, keyed by model name + generation config + persona
+PREFIX_CACHE_ENV_VAR = "CHARACTER_AI_PREFIX_CACHE"
+PREFIX_CACHE_TTL = 3600 # Seconds an explicit Gemini context cache lives
+MIN_CACHED_PREFIX_TOKENS = 4096 # Gemini rejects explicit caches smaller than this
+PREFIX_CACHE_MARGIN = 60 # Seconds before expiry a cached prefix is replaced, rather than race the expiry
+STUB_VARIANTS_KEPT = 10000 # Repeated requests a stub model remembers, to vary its replies
+
+
+def prefix_cache_enabled(environ=os.environ):
+    return environ.get(PREFIX_CACHE_ENV_VAR, "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+class Reply:
+    """A complete (non-streamed) reply."""
+
+    __slots__ = ("text", "usage")
+
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage = usage or {}
+
+
+class ChatBackend:
+    """Base class for backends. Subclasses implement `create_model`."""
+
+    name = "base"
+    requires_api_key = False
+
+    def __init__(self, pool_size=MODEL_POOL_SIZE):
+        self.pool_size = pool_size
+        self._models = OrderedDict()
+        self._models_lock = threading.Lock()
+
+    def configure(self, api_key):
+        """Set credentials. Backends that don't need a key ignore it."""
+
+    def create_model(self, model_name, generation_config=None, system_instruction=None):
+        raise NotImplementedError
+
+    def get_model(self, model_name, generation_config=None, system_instruction=None):
+        """Pooled `create_model`: reuse the handle for a model + config + persona seen recently.
+
+        Model handles hold no conversation state, so they are shared by every
+        session in the process; so is any prompt-prefix cache behind them.
+        Handles whose cache has expired are rebuilt. Handles dropped from the
+        pool are passed to `_discard_model`.
+        """
+        key = (model_name, tuple(sorted((generation_config or {}).items())), system_instruction)
+        with self._models_lock:
+            model = self._models.get(key)
+            if model is not None and not model.expired():
+                self._models.move_to_end(key)
+                return model
+        model = self.create_model(model_name, generation_config=generation_config,
+                                  system_instruction=system_instruction)
+        discarded = []
+        with self._models_lock:
+            pooled = self._models.get(key)
+            if pooled is not None and not pooled.expired():
+                discarded.append(model)
+                model = pooled # Another session built it first; keep a single cache per prefix
+            elif pooled is not None:
+                discarded.append(pooled)
+            self._models[key] = model
+            self._models.move_to_end(key)
+            while len(self._models) > self.pool_size:
+                discarded.append(self._models.popitem(last=False)[1])
+        for old_model in discarded:
+            self._discard_model(old_model)
+        return model
+
+    def _discard_model(self, model):
+        """Free what a model handle holds once the pool has dropped it; nothing by default."""
+
+    def count_tokens(self, text, model_name=None):
+        return estimate_tokens(text)
+
+
+# --- Gemini ---
+
+def _content_to_dict(content):
+    return {"role": content.role, "parts": [part.text for part in content.parts if part.text]}
+
+
+def _usage_from_response(response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return {}
+    return {
+        "prompt_tokens": getattr(usage, "prompt_token_count", None),
+        "cached_tokens": getattr(usage, "cached_content_token_count", None) or 0,
+        "output_tokens": getattr(usage, "candidates_token_count", None),
+        "total_tokens": getattr(usage, "total_token_count", None),
+    }
+
+
+def _request_options(timeout):
+    return {"timeout": timeout} if timeout is not None else None
+
+
+class GeminiChat:
+    def __init__(self, session):
+        self._session = session
+        self.last_usage = {}
+
+    @property
+    def history(self):
+        return [_content_to_dict(content) for content in self._session.history]
+
+    @history.setter
+    def history(self, history):
+        self._session.history = history
+
+    def send_message(self, text, timeout=None):
+        response = self._session.send_message(text, request_options=_request_options(timeout))
+        self.last_usage = _usage_from_response(response)
+        return Reply(response.text, self.last_usage)
+
+    def stream_message(self, text, timeout=None):
+        """Yield reply text chunks; history and usage are updated once drained."""
+        response = self._session.send_message(text, stream=True, request_options=_request_options(timeout))
+        yield from iter_chunk_text(response)
+        self.last_usage = _usage_from_response(response)
+
+
+class CachedPrefix:
+    """An explicit Gemini context cache holding one persona for one model, shared by its model handles."""
+
+    __slots__ = ("key", "content", "expires_at", "users", "deleted")
+
+    def __init__(self, key, content, expires_at):
+        self.key = key # (model name, system instruction)
+        self.content = content
+        self.expires_at = expires_at
+        self.users = 0 # Pooled model handles built on it
+        self.deleted = False
+
+    def expired(self):
+        return self.deleted or time.time() >= self.expires_at - PREFIX_CACHE_MARGIN
+
+
+class GeminiModel:
+    def __init__(self, model, prefix=None):
+        self._model = model
+        self.prefix = prefix # Set when the persona lives in an explicit context cache
+
+    def expired(self):
+        return self.prefix is not None and self.prefix.expired()
+
+    def start_chat(self, history=None):
+        return GeminiChat(self._model.start_chat(history=history or []))
+
+
+class GeminiBackend(ChatBackend):
+    """google-generativeai behind the backend interface.
+
+    The SDK takes a noticeable share of a cold start to import, so it is
+    imported on first real use (configuring a key, building a model), not
+    when the backend is created; the API key screen never pays for it.
+    `configure` only reconfigures the SDK when the key changes.
+
+    A persona long enough for explicit caching is cached once per model and
+    shared by the handles for every generation config; the cache is deleted
+    when the last of those handles leaves the model pool.
+    """
+
+    name = "gemini"
+    requires_api_key = True
+
+    def __init__(self, prefix_cache=True, cache_ttl=PREFIX_CACHE_TTL, min_cached_tokens=MIN_CACHED_PREFIX_TOKENS):
+        super().__init__()
+        self.prefix_cache = prefix_cache
+        self.cache_ttl = cache_ttl
+        self.min_cached_tokens = min_cached_tokens
+        self._genai_module = None
+        self._configured_key = None # Fingerprint of the key the SDK is configured with
+        self._configure_lock = threading.Lock()
+        self.configure_calls = 0 # Times the SDK was actually (re)configured
+        self._prefixes = {} # (model name, system instruction) -> CachedPrefix
+        self._prefixes_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(prefix_cache=prefix_cache_enabled(environ))
+
+    @property
+    def _genai(self):
+        if self._genai_module is None:
+            import google.generativeai as genai
+            self._genai_module = genai
+        return self._genai_module
+
+    def configure(self, api_key):
+        key = hashlib.sha256(api_key.encode("utf-8")).digest()
+        with self._configure_lock:
+            if key == self._configured_key:
+                return
+            self._genai.configure(api_key=api_key)
+            self._configured_key = key
+            self.configure_calls += 1
+
+    def create_model(self, model_name, generation_config=None, system_instruction=None):
+        if self.prefix_cache and system_instruction and estimate_tokens(system_instruction) >= self.min_cached_tokens:
+            try:
+                return self._create_cached_model(model_name, generation_config, system_instruction)
+            except Exception:
+                pass # Model without explicit caching support, quota, ...: the plain system instruction still works
+        return GeminiModel(self._genai.GenerativeModel(
+            model_name=model_name, generation_config=generation_config, system_instruction=system_instruction
+        ))
+
+    def _create_cached_model(self, model_name, generation_config, system_instruction):
+        """Build the model on the persona's explicit context cache, storing the persona first if it isn't cached yet."""
+        prefix = self._acquire_prefix(model_name, system_instruction)
+        try:
+            model = self._genai.GenerativeModel.from_cached_content(prefix.content, generation_config=generation_config)
+        except Exception:
+            self._release_prefix(prefix)
+            raise
+        return GeminiModel(model, prefix=prefix)
+
+    def _acquire_prefix(self, model_name, system_instruction):
+        key = (model_name, system_instruction)
+        with self._prefixes_lock:
+            prefix = self._prefixes.get(key)
+            if prefix is not None and not prefix.expired():
+                prefix.users += 1
+                return prefix
+        from google.generativeai import caching
+        expires_at = time.time() + self.cache_ttl
+        content = caching.CachedContent.create(
+            model=model_name if model_name.startswith("models/") else f"models/{model_name}",
+            system_instruction=system_instruction,
+            ttl=self.cache_ttl,
+        )
+        created = CachedPrefix(key, content, expires_at)
+        with self._prefixes_lock:
+            prefix = self._prefixes.get(key)
+            if prefix is None or prefix.expired():
+                prefix = self._prefixes[key] = created
+            prefix.users += 1
+        if prefix is not created:
+            self._delete_prefix(created) # Another session cached it first
+        return prefix
+
+    def _release_prefix(self, prefix):
+        with self._prefixes_lock:
+            prefix.users -= 1
+            if prefix.users > 0:
+                return
+            if self._prefixes.get(prefix.key) is prefix:
+                del self._prefixes[prefix.key]
+        self._delete_prefix(prefix)
+
+    @staticmethod
+    def _delete_prefix(prefix):
+        prefix.deleted = True # Handles still held by a session report expired() and get rebuilt
+        try:
+            prefix.content.delete()
+        except Exception:
+            pass # Already expired, or the network is down; it lapses on its own at the TTL
+
+    def _discard_model(self, model):
+        if model.prefix is not None:
+            self._release_prefix(model.prefix)
+
+    def count_tokens(self, text, model_name=None):
+        if model_name is None:
+            return estimate_tokens(text)
+        try:
+            return self._genai.GenerativeModel(model_name).count_tokens(text).total_tokens
+        except Exception:
+            return estimate_tokens(text) # count_tokens is a network call; don't fail the turn over it
+
+
+# --- Local stub ---
+
+STUB_VOCABULARY = (
+    "the", "stars", "whisper", "softly", "and", "I", "think", "you", "might", "like", "this", "story",
+    "about", "a", "quiet", "river", "that", "remembers", "every", "traveler", "who", "crossed", "it",
+    "so", "tell", "me", "more", "of", "what", "brings", "here", "today", "perhaps", "we", "can", "wander",
+)
+
+
+def _env_float(environ, key, default):
+    value = environ.get(key)
+    return float(value) if value else default
+
+
+def _env_int(environ, key, default):
+    value = environ.get(key)
+    return int(value) if value else default
+
+
+class StubChat:
+    def __init__(self, model, history):
+        self._model = model
+        self._history = [dict(entry) for entry in (history or [])]
+        self.last_usage = {}
+
+    @property
+    def history(self):
+        return list(self._history)
+
+    @history.setter
+    def history(self, history):
+        self._history = [dict(entry) for entry in history]
+
+    def _reply_text(self, text):
+        backend = self._model.backend
+        digest = hashlib.sha256(self._model.model_name.encode("utf-8"))
+        digest.update((self._model.system_instruction or "").encode("utf-8"))
+        for entry in self._history:
+            for part in entry["parts"]:
+                digest.update(part.encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+        variant = self._model.next_variant(digest.digest())
+        if variant:
+            digest.update(str(variant).encode("utf-8"))
+        rng = random.Random(digest.digest())
+        word_count = rng.randint(max(1, backend.reply_words // 2), backend.reply_words)
+        max_output_tokens = (self._model.generation_config or {}).get("max_output_tokens")
+        if max_output_tokens:
+            word_count = min(word_count, max_output_tokens)
+        words = [rng.choice(STUB_VOCABULARY) for _ in range(word_count)]
+        return f"(stub reply to: {text[:40]}) " + " ".join(words) + "."
+
+    def _prompt_tokens(self, text):
+        """Return `(prompt_tokens, cached_tokens)` for sending `text` on the current history."""
+        prompt_tokens = sum(estimate_tokens(part) for entry in self._history for part in entry["parts"])
+        prompt_tokens += estimate_tokens(text) + self._model.system_tokens
+        return prompt_tokens, self._model.cached_tokens
+
+    def _first_token_delay(self, text):
+        # Prefill cost scales with the prompt tokens that weren't served from the prefix cache
+        backend = self._model.backend
+        prompt_tokens, cached_tokens = self._prompt_tokens(text)
+        delay = backend.latency + backend.prefill_per_1k * (prompt_tokens - cached_tokens) / 1000.0
+        return delay * backend.slow_factor if backend.slow_rate and backend.rng.random() < backend.slow_rate else delay
+
+    def _record(self, text, reply_text):
+        prompt_tokens, cached_tokens = self._prompt_tokens(text)
+        self._history.append({"role": "user", "parts": [text]})
+        self._history.append({"role": "model", "parts": [reply_text]})
+        output_tokens = estimate_tokens(reply_text)
+        self.last_usage = {"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens,
+                           "output_tokens": output_tokens, "total_tokens": prompt_tokens + output_tokens}
+
+    def send_message(self, text, timeout=None):
+        backend = self._model.backend
+        reply_text = self._reply_text(text)
+        self._sleep(self._first_token_delay(text) + backend.chunk_delay * max(0, len(self._chunks(reply_text)) - 1), timeout)
+        self._record(text, reply_text)
+        return Reply(reply_text, self.last_usage)
+
+    def stream_message(self, text, timeout=None):
+        backend = self._model.backend
+        reply_text = self._reply_text(text)
+        self._sleep(self._first_token_delay(text), timeout)
+        for index, chunk in enumerate(self._chunks(reply_text)):
+            if index:
+                time.sleep(backend.chunk_delay)
+            yield chunk
+        self._record(text, reply_text)
+
+    @staticmethod
+    def _sleep(delay, timeout):
+        # Like a real request with a timeout: give up once it's spent
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Stub request timed out after {timeout:.1f}s")
+        time.sleep(delay)
+
+    def _chunks(self, reply_text):
+        words = reply_text.split(" ")
+        size = max(1, self._model.backend.chunk_words)
+        return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+                for i in range(0, len(words), size)]
+
+
+class StubModel:
+    def __init__(self, backend, model_name, generation_config, system_instruction=None):
+        self.backend = backend
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.system_instruction = system_instruction
+        self.system_tokens = estimate_tokens(system_instruction)
+        # Cached like GeminiBackend would: only a system instruction past the explicit-cache minimum
+        cached = backend.prefix_cache and system_instruction and self.system_tokens >= backend.min_cached_tokens
+        self.cached_tokens = self.system_tokens if cached else 0
+        self._variants = OrderedDict() # Request digest -> times asked
+        self._lock = threading.Lock()
+
+    def next_variant(self, request_digest):
+        """0 the first time a request is seen; with a temperature above 0, asking again counts up."""
+        if not (self.generation_config or {}).get("temperature"):
+            return 0
+        with self._lock:
+            variant = self._variants.pop(request_digest, 0)
+            self._variants[request_digest] = variant + 1
+            if len(self._variants) > STUB_VARIANTS_KEPT:
+                self._variants.popitem(last=False)
+        return variant
+
+    def expired(self):
+        return False
+
+    def start_chat(self, history=None):
+        return StubChat(self, history)
+
+
+class StubBackend(ChatBackend):
+    """Deterministic offline backend: same history + input -> same reply.
+
+    With a temperature above 0, asking the same thing again (a regenerated
+    reply) gives the next of a fixed sequence of replies, like sampling would.
+    `latency` is the delay before the first chunk, `chunk_delay` the delay
+    between chunks, `chunk_words` the words per chunk and `reply_words` the
+    upper bound on reply length. `prefill_per_1k` adds first-token delay per
+    1000 prompt tokens not covered by the prefix cache; with `prefix_cache`
+    on, a system instruction of at least `min_cached_tokens` is reported as
+    cached on every turn, as Gemini would cache it. A
+    `slow_rate` share of requests waits `slow_factor` times longer for the
+    first chunk, like a spiky latency tail.
+    """
+
+    name = "stub"
+
+    def __init__(self, latency=0.2, chunk_delay=0.02, chunk_words=3, reply_words=60, prefill_per_1k=0.0,
+                 prefix_cache=True, min_cached_tokens=MIN_CACHED_PREFIX_TOKENS, slow_rate=0.0, slow_factor=10.0,
+                 seed=None):
+        super().__init__()
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_words = chunk_words
+        self.reply_words = reply_words
+        self.prefill_per_1k = prefill_per_1k
+        self.prefix_cache = prefix_cache
+        self.min_cached_tokens = min_cached_tokens
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.rng = random.Random(seed) # Only for latency; reply text doesn't depend on it
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            latency=_env_float(environ, "CHARACTER_AI_STUB_LATENCY", 0.2),
+            chunk_delay=_env_float(environ, "CHARACTER_AI_STUB_CHUNK_DELAY", 0.02),
+            chunk_words=_env_int(environ, "CHARACTER_AI_STUB_CHUNK_WORDS", 3),
+            reply_words=_env_int(environ, "CHARACTER_AI_STUB_REPLY_WORDS", 60),
+            prefill_per_1k=_env_float(environ, "CHARACTER_AI_STUB_PREFILL_PER_1K", 0.0),
+            prefix_cache=prefix_cache_enabled(environ),
+            slow_rate=_env_float(environ, "CHARACTER_AI_STUB_SLOW_RATE", 0.0),
+            slow_factor=_env_float(environ, "CHARACTER_AI_STUB_SLOW_FACTOR", 10.0),
+        )
+
+    def create_model(self, model_name, generation_config=None, system_instruction=None):
+        return StubModel(self, model_name, generation_config, system_instruction)
+
+
+BACKENDS = {
+    "gemini": GeminiBackend.from_env,
+    "stub": StubBackend.from_env,
+}
+
+_backend_instances = {}
+
+
+def get_backend(name=None, environ=os.environ):
+    """Return the process-wide backend named `name` (default: from the env var)."""
+    name = (name or environ.get(BACKEND_ENV_VAR) or DEFAULT_BACKEND).strip().lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}; expected one of: {', '.join(sorted(BACKENDS))}")
+    if name not in _backend_instances:
+        _backend_instances[name] = BACKENDS[name](environ)
+    return _backend_instances[name]
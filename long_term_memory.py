@@ -0,0 +1,109 @@
+"""Per-conversation long-term memory: BM25 retrieval over past exchanges.
+
+The context window only replays the last few exchanges verbatim plus a short
+extractive summary, so details from early in a long chat drop out of the
+prompt. This index keeps every exchange searchable. For each new message,
+the best matching earlier exchanges are pulled into the prompt as a few short
+snippets, so recall holds up while the prompt stays a fixed size.
+
+The index is an in-memory inverted index updated as each exchange is added
+(postings are appended, nothing is rebuilt), and queries only touch the
+postings of the message's terms. No external services or dependencies.
+"""
+import heapq
+import math
+import re
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_CHARS = 160 # Per side of an exchange, so a snippet's size is bounded
+
+_WORD = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+a about all also am an and any are as at be been but by can could did do does doing for from had has have he her
+here him his how i i'm if in into is it it's its just me my no not now of on one or our out so some than that the
+their them then there these they this to too up us very was we were what when where which who why will with would
+you you're your yours
+""".split())
+
+
+def tokenize(text):
+    """Lowercase words minus stopwords, with a trailing plural/possessive 's' dropped."""
+    terms = []
+    for word in _WORD.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if word.endswith("'s"):
+            word = word[:-2]
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def _clip(text, max_chars=SNIPPET_CHARS):
+    text = " ".join(text.split())
+    return text if len(text) <= max_chars else text[:max_chars - 1].rstrip() + "…"
+
+
+class ConversationMemory:
+    """Inverted index over one conversation's exchanges; document ids are exchange positions."""
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.exchanges = [] # (user_text, model_text), shared with the transcript rather than copied
+        self._postings = {} # term -> [(exchange_id, term_frequency)] in id order
+        self._lengths = []
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self.exchanges)
+
+    def add(self, user_text, model_text):
+        exchange_id = len(self.exchanges)
+        self.exchanges.append((user_text, model_text))
+        terms = tokenize(user_text) + tokenize(model_text)
+        frequencies = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            self._postings.setdefault(term, []).append((exchange_id, frequency))
+        self._lengths.append(len(terms))
+        self._total_length += len(terms)
+        return exchange_id
+
+    def replace_last(self, user_text, model_text):
+        """Re-index the newest exchange with new text (e.g. a regenerated reply)."""
+        old_user_text, old_model_text = self.exchanges.pop()
+        for term in set(tokenize(old_user_text) + tokenize(old_model_text)):
+            postings = self._postings[term]
+            postings.pop() # The newest exchange's posting is always last
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop()
+        return self.add(user_text, model_text)
+
+    def search(self, query, k=3, before=None):
+        """Top `k` `(exchange_id, score)` for `query`, best first, among exchanges with id < `before`."""
+        count = len(self.exchanges) if before is None else min(before, len(self.exchanges))
+        if k <= 0 or not count:
+            return []
+        average_length = self._total_length / len(self.exchanges) or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (len(self.exchanges) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for exchange_id, frequency in postings:
+                if exchange_id >= count:
+                    break # Postings are in id order
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[exchange_id] / average_length)
+                scores[exchange_id] = scores.get(exchange_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], item[0]))
+
+    def snippets(self, query, k=3, before=None):
+        """Short "User: ... / You: ..." lines for the best matches, oldest first."""
+        matches = sorted(exchange_id for exchange_id, _ in self.search(query, k=k, before=before))
+        return [f"- User: {_clip(self.exchanges[i][0])} / You: {_clip(self.exchanges[i][1])}" for i in matches]
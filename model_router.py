@@ -0,0 +1,203 @@
+"""Per-turn model routing with automatic fallback.
+
+With auto-routing, the model is picked for each message instead of once in
+the sidebar. A short message with a small reply budget (`max_tokens`) is a
+"light" request and goes to the light model; a long message or a large
+budget goes to the heavy one. Recent outcomes can overrule that choice:
+
+- a model whose calls in the last minute mostly failed is moved to the back
+  (once they age out, it gets another chance)
+- a model much slower than another one on the same kind of request is moved
+  behind it (latencies are compared per request size, since heavy requests
+  are slower on any model)
+- every `explore_every`-th request of a size goes to the least-observed
+  alternative first, so its latency figures don't go stale
+
+The models after the first are fallbacks. A quota error, a timeout or an
+open circuit breaker moves the turn on to the next model instead of retrying
+the same one. Each model gets an equal share of the time left, so a fallback
+still has time to answer. A RouteDecision records the choice, the reasons
+and any fallbacks; `as_dict()` goes into the turn's telemetry event.
+
+The router is process-wide and shared by every session, like the circuit
+breakers.
+"""
+import os
+import statistics
+import threading
+import time
+from collections import deque
+
+from context_window import estimate_tokens
+from resilience import CircuitOpenError, is_retryable
+
+AUTO_MODEL = "auto" # Model picker value that turns routing on
+LIGHT, HEAVY = "light", "heavy"
+DEFAULT_LIGHT_MODEL = "gemini-2.0-flash-lite"
+DEFAULT_HEAVY_MODEL = "gemini-2.0-flash"
+SHORT_MESSAGE_TOKENS = 200 # Longer messages are heavy requests
+LIGHT_MAX_TOKENS = 512 # Larger reply budgets are heavy requests
+OUTCOME_WINDOW = 20 # Recent outcomes per model for the error rate
+OUTCOME_MAX_AGE = 60.0 # Seconds an outcome counts towards the error rate
+LATENCY_WINDOW = 50 # Recent latencies per model and request size
+MIN_SAMPLES = 5 # Outcomes needed before a model's figures count
+MAX_ERROR_RATE = 0.5 # Models failing more often than this go to the back
+SLOW_FACTOR = 2.0 # A model this many times slower (median) than another gives way
+EXPLORE_EVERY = 20
+
+QUOTA_ERROR_NAMES = {"ResourceExhausted", "TooManyRequests"}
+TIMEOUT_ERROR_NAMES = {"DeadlineExceeded", "GatewayTimeout"}
+
+
+def is_fallback_error(error):
+    """Errors that should move a turn to the next model rather than be retried on the same one."""
+    if isinstance(error, (TimeoutError, CircuitOpenError)):
+        return True
+    if type(error).__name__ in QUOTA_ERROR_NAMES | TIMEOUT_ERROR_NAMES:
+        return True
+    return getattr(error, "code", None) in (408, 429, 504)
+
+
+class RouteDecision:
+    """Models to try for one turn, best first, and why; `model` is set to the one that answered."""
+
+    def __init__(self, size, models, reasons):
+        self.size = size
+        self.models = models
+        self.reasons = reasons
+        self.model = None
+        self.fallbacks = [] # (model, error text) for each model given up on
+
+    def as_dict(self):
+        return {
+            "size": self.size,
+            "candidates": list(self.models),
+            "reasons": list(self.reasons),
+            "model": self.model,
+            "fallbacks": [{"model": model, "error": error} for model, error in self.fallbacks],
+        }
+
+
+class ModelHealth:
+    def __init__(self):
+        self.outcomes = deque(maxlen=OUTCOME_WINDOW) # (time, True for a successful call)
+        self.latencies = {LIGHT: deque(maxlen=LATENCY_WINDOW), HEAVY: deque(maxlen=LATENCY_WINDOW)}
+
+    def error_rate(self, now):
+        recent = [ok for at, ok in self.outcomes if now - at <= OUTCOME_MAX_AGE]
+        if len(recent) < MIN_SAMPLES:
+            return None
+        return 1.0 - sum(recent) / len(recent)
+
+    def median_latency(self, size):
+        samples = self.latencies[size]
+        return statistics.median(samples) if len(samples) >= MIN_SAMPLES else None
+
+
+class ModelRouter:
+    def __init__(self, light_model=DEFAULT_LIGHT_MODEL, heavy_model=DEFAULT_HEAVY_MODEL, short_message_tokens=SHORT_MESSAGE_TOKENS,
+                 light_max_tokens=LIGHT_MAX_TOKENS, max_error_rate=MAX_ERROR_RATE, slow_factor=SLOW_FACTOR,
+                 explore_every=EXPLORE_EVERY, clock=time.monotonic):
+        self.light_model = light_model
+        self.heavy_model = heavy_model
+        self.models = [light_model] if light_model == heavy_model else [light_model, heavy_model]
+        self.short_message_tokens = short_message_tokens
+        self.light_max_tokens = light_max_tokens
+        self.max_error_rate = max_error_rate
+        self.slow_factor = slow_factor
+        self.explore_every = explore_every
+        self.clock = clock
+        self._health = {model: ModelHealth() for model in self.models}
+        self._requests = {LIGHT: 0, HEAVY: 0}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            light_model=environ.get("CHARACTER_AI_ROUTER_LIGHT_MODEL") or DEFAULT_LIGHT_MODEL,
+            heavy_model=environ.get("CHARACTER_AI_ROUTER_HEAVY_MODEL") or DEFAULT_HEAVY_MODEL,
+        )
+
+    @property
+    def default_model(self):
+        """Model for calls that aren't routed one by one (e.g. setting up a chat or a group chat)."""
+        return self.heavy_model
+
+    def route(self, text, max_tokens):
+        message_tokens = estimate_tokens(text)
+        size = HEAVY if message_tokens > self.short_message_tokens or max_tokens > self.light_max_tokens else LIGHT
+        preferred = self.heavy_model if size == HEAVY else self.light_model
+        models = [preferred] + [model for model in self.models if model != preferred]
+        reasons = [f"{size} request (~{message_tokens} message tokens, max {max_tokens} output tokens)"]
+        with self._lock:
+            self._requests[size] += 1
+            request_number = self._requests[size]
+            now = self.clock()
+            error_rates = {model: self._health[model].error_rate(now) for model in models}
+            latencies = {model: self._health[model].median_latency(size) for model in models}
+            samples = {model: len(self._health[model].latencies[size]) for model in models}
+
+        failing = [model for model in models if (error_rates[model] or 0.0) > self.max_error_rate]
+        if failing and len(failing) < len(models):
+            models = [model for model in models if model not in failing] + failing
+            reasons += [f"{model} failing ({error_rates[model]:.0%} errors)" for model in failing]
+        healthy = [model for model in models if model not in failing] or models
+
+        first = healthy[0]
+        faster = [model for model in healthy[1:] if latencies[first] is not None and latencies[model] is not None
+                  and latencies[first] > self.slow_factor * latencies[model]]
+        if faster:
+            fastest = min(faster, key=lambda model: latencies[model])
+            models.remove(fastest)
+            models.insert(0, fastest)
+            reasons.append(f"{first} slow on {size} requests (median {latencies[first]:.2f}s vs {latencies[fastest]:.2f}s)")
+        elif self.explore_every and request_number % self.explore_every == 0 and len(healthy) > 1:
+            probe = min(healthy[1:], key=lambda model: samples[model])
+            models.remove(probe)
+            models.insert(0, probe)
+            reasons.append(f"probing {probe} to refresh its latency")
+        return RouteDecision(size, models, reasons)
+
+    def record(self, model, size, latency, ok):
+        with self._lock:
+            health = self._health.setdefault(model, ModelHealth())
+            health.outcomes.append((self.clock(), ok))
+            if ok:
+                health.latencies[size].append(latency)
+
+    def call(self, decision, attempt, remaining=None):
+        """Return `attempt(model, timeout, can_fall_back)` from the first model in `decision` that answers.
+
+        `remaining()` gives the seconds left for the whole turn; each model gets
+        an equal share of it as `timeout` (None if `remaining` isn't given).
+        When `can_fall_back` is true, the attempt should let fallback errors
+        through instead of retrying them, so the next model gets its turn.
+        """
+        for index, model in enumerate(decision.models):
+            models_left = len(decision.models) - index
+            timeout = None if remaining is None else remaining() / models_left
+            started_at = self.clock()
+            try:
+                result = attempt(model, timeout, models_left > 1)
+            except Exception as e:
+                if is_retryable(e): # Backend trouble counts against the model; bad input or a cancelled turn doesn't
+                    self.record(model, decision.size, self.clock() - started_at, ok=False)
+                if models_left == 1 or not is_fallback_error(e):
+                    decision.model = model
+                    raise
+                decision.fallbacks.append((model, f"{type(e).__name__}: {e}"))
+                continue
+            self.record(model, decision.size, self.clock() - started_at, ok=True)
+            decision.model = model
+            return result
+
+    def stats(self):
+        with self._lock:
+            now = self.clock()
+            return {
+                model: {
+                    "error_rate": health.error_rate(now),
+                    "median_latency": {size: health.median_latency(size) for size in (LIGHT, HEAVY)},
+                }
+                for model, health in self._health.items()
+            }
@@ -0,0 +1,317 @@
+"""Client-side protection around generation calls.
+
+- `TokenBucket`: rate limiter shared by every session using the same API key
+- `RetryPolicy`: jittered exponential backoff for retryable errors
+- `CircuitBreaker`: fails fast while the backend keeps failing
+- `ResilientCaller`: combines the three and records metrics
+
+Limiters and breakers are process-wide (see `get_rate_limiter` and
+`get_circuit_breaker`) so all Streamlit sessions in the server share them.
+"""
+import hashlib
+import random
+import threading
+import time
+
+# Google API errors that are worth retrying, matched by class name so the SDK isn't imported here
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "Aborted",
+}
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# The caller gave up (generation.GenerationCancelled / GenerationTimeout): says nothing about the backend's health
+ABANDONED_ERROR_NAMES = {"GenerationCancelled", "GenerationTimeout"}
+CHECK_INTERVAL = 0.05 # Seconds between `check()` calls while waiting
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling the backend while the circuit breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"The model backend is unavailable; retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code in RETRYABLE_STATUS_CODES
+
+
+def _wait(seconds, sleep, check=None, remaining=None):
+    """Sleep up to `seconds`, but not past `remaining()`, calling `check()` between short sleeps; returns the time slept."""
+    if remaining is not None:
+        seconds = min(seconds, remaining())
+    slept = 0.0
+    while slept < seconds:
+        step = seconds - slept if check is None else min(CHECK_INTERVAL, seconds - slept)
+        sleep(step)
+        slept += step
+        if check is not None:
+            check()
+    return slept
+
+
+class TokenBucket:
+    """`rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(capacity)
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token now, or return how long to wait before trying again."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def try_acquire(self):
+        """Take a token if one is available right now; never waits."""
+        return self._reserve() <= 0
+
+    def acquire(self, check=None, remaining=None):
+        """Block until a token is available; returns the seconds spent waiting.
+
+        `check()` is called before each reservation and while waiting, and may
+        raise to give up (e.g. GenerationJob.check). Waiting stops at
+        `remaining()` seconds; if no token came by then, raises TimeoutError.
+        """
+        waited = 0.0
+        while True:
+            if check is not None:
+                check()
+            if remaining is not None and remaining() <= 0:
+                raise TimeoutError("No request allowed by the rate limiter before the deadline.")
+            delay = self._reserve()
+            if delay <= 0:
+                return waited
+            waited += _wait(delay, self.sleep, check, remaining)
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter: sleep U(0, min(max_delay, base * 2**attempt))."""
+
+    def __init__(self, max_attempts=4, base_delay=0.5, max_delay=8.0, rng=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt):
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures, half-opens after `reset_timeout`."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """Raise CircuitOpenError if calls should fail fast right now; returns True if this call is the half-open trial."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return False
+            remaining = self.reset_timeout - (self.clock() - self._opened_at)
+            if self._state == self.OPEN and remaining > 0:
+                raise CircuitOpenError(remaining)
+            # Half-open: let a single trial call through
+            if self._trial_in_flight:
+                raise CircuitOpenError(max(remaining, 1.0))
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = True
+            return True
+
+    def release_trial(self):
+        """Let another half-open trial through; for a trial call that ended without an answer (e.g. cancelled)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+            self._trial_in_flight = False
+
+
+class ResilienceMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.fast_failures = 0
+        self.throttle_seconds = 0.0
+        self.backoff_seconds = 0.0
+        self.timeouts = 0 # Replies abandoned at their deadline
+        self.cancellations = 0 # Replies abandoned because the user moved on
+
+    def add(self, **increments):
+        with self._lock:
+            for name, amount in increments.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls, "successes": self.successes, "failures": self.failures,
+                "retries": self.retries, "fast_failures": self.fast_failures,
+                "throttle_seconds": self.throttle_seconds, "backoff_seconds": self.backoff_seconds,
+                "timeouts": self.timeouts, "cancellations": self.cancellations,
+            }
+
+
+class ResilientCaller:
+    """Run a call through the rate limiter, retry policy and circuit breaker.
+
+    `retry_if(error)` narrows which retryable errors are retried (e.g. to hand
+    quota errors to another model instead); the breaker still counts them.
+    A call the caller abandoned (cancelled or out of time) counts as neither a
+    success nor a failure.
+    """
+
+    def __init__(self, limiter=None, breaker=None, policy=None, metrics=None, sleep=time.sleep, retry_if=None):
+        self.limiter = limiter
+        self.breaker = breaker
+        self.policy = policy or RetryPolicy()
+        self.metrics = metrics or ResilienceMetrics()
+        self.sleep = sleep
+        self.retry_if = retry_if
+
+    def call(self, fn, on_retry=None, check=None, remaining=None):
+        """Return `fn()`, retrying retryable errors. `on_retry(attempt, error, delay)` is optional.
+
+        `check()` and `remaining()` tie the call to a deadline, e.g. a
+        GenerationJob's `check` and `remaining`: `check` runs before each
+        attempt and while waiting for the limiter or a backoff, and may raise
+        to give up; no wait goes past `remaining()`, and a retry that couldn't
+        start before it isn't made.
+        """
+        self.metrics.add(calls=1)
+        attempt = 0
+        while True:
+            if check is not None:
+                try:
+                    check()
+                except Exception:
+                    self.metrics.add(failures=1)
+                    raise
+            trial = False
+            if self.breaker is not None:
+                try:
+                    trial = self.breaker.before_call()
+                except CircuitOpenError:
+                    self.metrics.add(fast_failures=1, failures=1)
+                    raise
+            if self.limiter is not None:
+                try:
+                    self.metrics.add(throttle_seconds=self.limiter.acquire(check, remaining))
+                except Exception:
+                    if trial:
+                        self.breaker.release_trial() # Never reached the backend
+                    self.metrics.add(failures=1)
+                    raise
+            try:
+                result = fn()
+            except Exception as e:
+                retryable = is_retryable(e)
+                if self.breaker is not None and type(e).__name__ in ABANDONED_ERROR_NAMES:
+                    if trial:
+                        self.breaker.release_trial()
+                elif self.breaker is not None and retryable:
+                    self.breaker.record_failure() # Only backend trouble trips the breaker, not bad input
+                elif self.breaker is not None:
+                    self.breaker.record_success()
+                attempt += 1
+                if self.retry_if is not None and retryable:
+                    retryable = self.retry_if(e)
+                delay = self.policy.delay(attempt - 1) if retryable and attempt < self.policy.max_attempts else None
+                if delay is None or (remaining is not None and delay >= remaining()): # No time left to try again
+                    self.metrics.add(failures=1)
+                    raise
+                self.metrics.add(retries=1, backoff_seconds=delay)
+                if on_retry is not None:
+                    on_retry(attempt, e, delay)
+                _wait(delay, self.sleep, check, remaining)
+                continue
+            if self.breaker is not None:
+                self.breaker.record_success()
+            self.metrics.add(successes=1)
+            return result
+
+
+_registry_lock = threading.Lock()
+_rate_limiters = {}
+_circuit_breakers = {}
+_metrics = ResilienceMetrics()
+
+
+def api_key_id(api_key):
+    """Non-reversible id for an API key, so raw keys aren't kept as dict keys."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+def get_rate_limiter(key_id, requests_per_minute=60, burst=10):
+    with _registry_lock:
+        limiter = _rate_limiters.get(key_id)
+        if limiter is None:
+            limiter = _rate_limiters[key_id] = TokenBucket(requests_per_minute / 60.0, burst)
+        return limiter
+
+
+def get_circuit_breaker(name, failure_threshold=5, reset_timeout=30.0):
+    with _registry_lock:
+        breaker = _circuit_breakers.get(name)
+        if breaker is None:
+            breaker = _circuit_breakers[name] = CircuitBreaker(failure_threshold, reset_timeout)
+        return breaker
+
+
+def get_circuit_breakers():
+    """Current state of every breaker by name, e.g. `{"gemini:gemini-2.0-flash": "closed"}`."""
+    with _registry_lock:
+        breakers = list(_circuit_breakers.items())
+    return {name: breaker.state for name, breaker in breakers}
+
+
+def get_metrics():
+    """Process-wide resilience metrics."""
+    return _metrics
@@ -0,0 +1,180 @@
+"""Process-wide reply cache with LRU + TTL eviction and request coalescing.
+
+Keys cover everything that shapes a reply: model, temperature, max tokens,
+persona, a hash of the replayed conversation prefix and the user input.
+Identical requests that arrive while one is already in flight wait for that
+call instead of starting their own (single-flight), so a burst of "hi"s to
+the same character costs one backend round trip. A waiting caller keeps its
+own deadline and can be cancelled, and if the call it waits on is cancelled
+or times out, one of the waiting callers makes the call instead.
+
+An optional SQLite file backs the in-memory LRU so entries survive restarts.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CHECK_INTERVAL = 0.05 # Seconds between a waiting caller's checks
+
+
+def hash_history(history):
+    """Stable hash of a `{"role", "parts"}` history list."""
+    payload = json.dumps(history, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(model_name, temperature, max_tokens, persona, history, user_input):
+    parts = [
+        model_name,
+        repr(float(temperature)),
+        str(int(max_tokens)),
+        hashlib.sha256(persona.encode("utf-8")).hexdigest(),
+        hash_history(history),
+        user_input,
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class _InFlight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """Thread-safe LRU/TTL cache of reply text.
+
+    `ttl` is in seconds (None = never expire). `disk_path` enables the
+    SQLite backing store.
+    """
+
+    def __init__(self, max_entries=512, ttl=3600.0, disk_path=None, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict() # key -> (stored_at, text)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "disk_hits": 0, "evictions": 0, "expirations": 0}
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, stored_at REAL, text TEXT)")
+            self._db.commit()
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and self.clock() - stored_at > self.ttl
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._expired(entry[0]):
+                self._entries.move_to_end(key)
+                return entry[1]
+            del self._entries[key]
+            self._stats["expirations"] += 1
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT stored_at, text FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if self._expired(row[0]):
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+            self._stats["expirations"] += 1
+            return None
+        self._stats["disk_hits"] += 1
+        self._store_memory_locked(key, row[0], row[1])
+        return row[1]
+
+    def _store_memory_locked(self, key, stored_at, text):
+        self._entries[key] = (stored_at, text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def get(self, key):
+        """Return the cached text for `key`, or None. Counts a hit or miss."""
+        with self._lock:
+            text = self._get_locked(key)
+            self._stats["hits" if text is not None else "misses"] += 1
+            return text
+
+    def put(self, key, text):
+        with self._lock:
+            stored_at = self.clock()
+            self._store_memory_locked(key, stored_at, text)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses (key, stored_at, text) VALUES (?, ?, ?)",
+                                 (key, stored_at, text))
+                self._db.commit()
+
+    def get_or_compute(self, key, compute, check=None, retry_if=None, check_interval=CHECK_INTERVAL):
+        """Return `(text, source)` where source is "hit", "coalesced" or "miss".
+
+        On a miss, `compute()` runs in the calling thread and its result is
+        cached. Concurrent callers with the same key block until it finishes
+        and share its result (or its exception). A waiting caller calls
+        `check()` every `check_interval` seconds, so it can give up on its own
+        deadline or cancellation by raising. If the call fails with an error
+        `retry_if(error)` accepts (e.g. the computing caller was cancelled),
+        the waiting callers don't share it: the next one computes instead.
+        """
+        while True:
+            with self._lock:
+                text = self._get_locked(key)
+                if text is not None:
+                    self._stats["hits"] += 1
+                    return text, "hit"
+                flight = self._in_flight.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._in_flight[key] = _InFlight()
+                    self._stats["misses"] += 1
+            if leader:
+                break
+
+            while not flight.done.wait(None if check is None else check_interval):
+                check()
+            if flight.error is not None and retry_if is not None and retry_if(flight.error):
+                continue # The computing caller's own failure: try again, maybe computing it ourselves
+            with self._lock:
+                self._stats["coalesced"] += 1
+            if flight.error is not None:
+                raise flight.error
+            return flight.value, "coalesced"
+
+        try:
+            flight.value = compute()
+            self.put(key, flight.value)
+            return flight.value, "miss"
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            flight.done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["in_flight"] = len(self._in_flight)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = (stats["hits"] + stats["coalesced"]) / lookups if lookups else 0.0
+        return stats
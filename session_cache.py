@@ -0,0 +1,111 @@
+"""Per-user-session LRU cache of recent character chats.
+
+Switching characters used to throw the current conversation away. Instead,
+the app parks the outgoing chat (transcript, context window and chat
+session) here and picks it back up when the user returns, so switching back
+is a dict lookup with no new backend setup.
+
+The cache is bounded both by entry count and by an estimate of the text it
+holds; the least recently used chats are dropped first. Saved conversations
+are still in the conversation store after eviction, so an evicted chat is
+resumed from there instead of restarted.
+"""
+import os
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 5
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+ENTRY_OVERHEAD_BYTES = 1024 # Rough fixed cost of the objects around the text
+
+
+class ParkedChat:
+    """Everything needed to put a character's chat back on screen."""
+
+    __slots__ = ("messages", "context_window", "chat_session", "model_instance",
+                 "conversation_id", "oldest_loaded_seq", "render_window", "size")
+
+    def __init__(self, messages, context_window, chat_session, model_instance,
+                 conversation_id=None, oldest_loaded_seq=None, render_window=None):
+        self.messages = messages
+        self.context_window = context_window
+        self.chat_session = chat_session
+        self.model_instance = model_instance
+        self.conversation_id = conversation_id
+        self.oldest_loaded_seq = oldest_loaded_seq
+        self.render_window = render_window
+        self.size = estimate_size(messages, context_window)
+
+
+def estimate_size(messages, context_window):
+    """Approximate bytes held by a chat: its transcript plus its context and long-term memory."""
+    size = ENTRY_OVERHEAD_BYTES + sum(len(turn.content) for turn in messages)
+    if context_window is not None:
+        size += len(context_window.summary)
+        # The long-term memory holds every exchange, the replayed ones included
+        size += sum(len(user_text) + len(model_text) for user_text, model_text in context_window.memory.exchanges)
+    return size
+
+
+class CharacterSessionCache:
+    """LRU of ParkedChat keyed by (character, user_id)."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            max_entries=int(environ.get("CHARACTER_AI_SESSION_CACHE_SIZE") or DEFAULT_MAX_ENTRIES),
+            max_bytes=int(float(environ.get("CHARACTER_AI_SESSION_CACHE_MB") or DEFAULT_MAX_BYTES / 1024 / 1024) * 1024 * 1024),
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def items(self):
+        """(key, chat) pairs, least recently used first."""
+        return list(self._entries.items())
+
+    def park(self, key, chat):
+        """Store `chat` as the most recently used entry, evicting old ones to stay in bounds."""
+        self.discard(key)
+        if self.max_entries <= 0 or chat.size > self.max_bytes:
+            return # Too big to keep; the conversation store still has it if it was saved
+        self._entries[key] = chat
+        self.total_bytes += chat.size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evictions += 1
+
+    def take(self, key):
+        """Remove and return the parked chat for `key`, or None. The active chat isn't kept in the cache."""
+        chat = self._entries.pop(key, None)
+        if chat is None:
+            self.misses += 1
+            return None
+        self.total_bytes -= chat.size
+        self.hits += 1
+        return chat
+
+    def discard(self, key):
+        chat = self._entries.pop(key, None)
+        if chat is not None:
+            self.total_bytes -= chat.size
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self):
+        return {"entries": len(self._entries), "bytes": self.total_bytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,330 @@
+"""Server-wide cap on the memory held by browser sessions.
+
+Streamlit keeps each tab's `st.session_state` (transcript, context window,
+chat session, parked chats, group chat) until the tab goes away, so a few
+hundred idle tabs add up. Every session checks in with the process-wide
+SessionManager on each rerun and reports its footprint after each turn. When
+the total goes over the cap, the least recently active sessions that have been
+idle for a while are spilled: their chats are written to a JSON file and the
+heavy state is dropped. The next time that user interacts, the chats are read
+back and the active one is restored through the character session cache,
+which rebuilds the chat session from the context window.
+
+A session is only spilled while it is idle, and check-ins take the manager's
+lock, so a spill never races with that session's own rerun. Liveness is
+checked by Streamlit's session id: once the runtime no longer has the session
+(the tab closed, and a disconnected tab wasn't back within the reconnect
+window), its entry and spill file are dropped.
+"""
+import json
+import os
+import threading
+import time
+
+from context_window import ContextWindow
+from session_cache import CharacterSessionCache, ParkedChat, estimate_size
+from transcript import Turn
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_IDLE_SECONDS = 300
+DEFAULT_SPILL_DIR = "session_spill"
+DEFAULT_FORGET_AFTER = 24 * 3600 # Spill files this old at startup are from sessions that no longer exist
+SPILL_VERSION = 1
+
+# Session state the manager drops on spill; everything else (settings, widget values) stays in memory
+HEAVY_KEYS = ("messages", "context_window", "chat_session", "model_instance",
+              "group_messages", "group_members", "restored_group_windows")
+
+
+def _get(state, key, default=None):
+    return state[key] if key in state else default
+
+
+def estimate_session_bytes(state):
+    """Approximate bytes of chat text a session holds, in the same units as the character session cache."""
+    size = estimate_size(_get(state, "messages") or [], _get(state, "context_window"))
+    size += sum(len(turn.content) for turn in _get(state, "group_messages") or [])
+    for member in (_get(state, "group_members") or {}).values():
+        size += estimate_size([], member.context_window)
+    character_sessions = _get(state, "character_sessions")
+    if character_sessions is not None:
+        size += character_sessions.total_bytes
+    return size
+
+
+# --- Spill format ---
+
+def _chat_to_dict(chat):
+    return {
+        "messages": [turn.as_message() for turn in chat.messages],
+        "context_window": chat.context_window.to_dict() if chat.context_window is not None else None,
+        "conversation_id": chat.conversation_id,
+        "oldest_loaded_seq": chat.oldest_loaded_seq,
+        "render_window": chat.render_window,
+    }
+
+
+def _chat_from_dict(data):
+    # No chat session or model: the app rebuilds them from the context window when the chat is taken back
+    return ParkedChat(
+        [Turn(message["role"], message["content"], message.get("character")) for message in data["messages"]],
+        ContextWindow.from_dict(data["context_window"]) if data["context_window"] is not None else None,
+        None, None, conversation_id=data["conversation_id"], oldest_loaded_seq=data["oldest_loaded_seq"],
+        render_window=data["render_window"],
+    )
+
+
+def dump_session_state(state):
+    """The chats a session holds, as a JSON-serializable dict."""
+    parked = []
+    character_sessions = _get(state, "character_sessions")
+    if character_sessions is not None:
+        parked = [{"key": list(key), "chat": _chat_to_dict(chat)} for key, chat in character_sessions.items()]
+    active = None
+    if _get(state, "chat_session") is not None and _get(state, "current_character_for_session"):
+        active = {
+            "key": [state["current_character_for_session"], _get(state, "conversation_user_id", "")],
+            "chat": _chat_to_dict(ParkedChat(
+                state["messages"], state["context_window"], None, None,
+                conversation_id=_get(state, "conversation_id"), oldest_loaded_seq=_get(state, "oldest_loaded_seq"),
+                render_window=_get(state, "render_window"),
+            )),
+        }
+    group_windows = {name: member.context_window.to_dict() for name, member in (_get(state, "group_members") or {}).items()}
+    group_windows.update({name: window.to_dict() for name, window in (_get(state, "restored_group_windows") or {}).items()})
+    return {
+        "version": SPILL_VERSION,
+        "active": active,
+        "parked": parked,
+        "group_messages": [turn.as_message() for turn in _get(state, "group_messages") or []],
+        "group_windows": group_windows,
+    }
+
+
+def clear_session_state(state):
+    for key in HEAVY_KEYS:
+        if key in state:
+            del state[key]
+    character_sessions = _get(state, "character_sessions")
+    if character_sessions is not None:
+        character_sessions.clear()
+
+
+def restore_session_state(state, data):
+    """Put spilled chats back: parked chats into the character session cache, the active one on top.
+
+    `messages` is set right away so the page renders before chat init takes the
+    active chat back out of the cache and rebuilds its chat session.
+    """
+    if data.get("version") != SPILL_VERSION:
+        raise ValueError(f"Unsupported spill file version {data.get('version')!r}")
+    character_sessions = _get(state, "character_sessions")
+    if character_sessions is None:
+        character_sessions = state["character_sessions"] = CharacterSessionCache.from_env()
+    for entry in data["parked"]:
+        character_sessions.park(tuple(entry["key"]), _chat_from_dict(entry["chat"]))
+    if data["active"] is not None:
+        active_chat = _chat_from_dict(data["active"]["chat"])
+        character_sessions.park(tuple(data["active"]["key"]), active_chat)
+        state["messages"] = active_chat.messages
+    state["chat_session"] = None
+    state["group_messages"] = [Turn(message["role"], message["content"], message.get("character"))
+                               for message in data["group_messages"]]
+    state["group_members"] = {}
+    state["restored_group_windows"] = {name: ContextWindow.from_dict(window)
+                                       for name, window in data["group_windows"].items()}
+
+
+class TrackedSession:
+    __slots__ = ("session_id", "state", "runtime_id", "size", "last_active", "spill_path", "closed_since")
+
+    def __init__(self, session_id, state, last_active, runtime_id=None):
+        self.session_id = session_id
+        self.state = state
+        self.runtime_id = runtime_id
+        self.size = 0
+        self.last_active = last_active
+        self.spill_path = None # Set while the session's chats are on disk
+        self.closed_since = None # When `is_alive` first said the session was gone
+
+
+class SessionManager:
+    """Tracks every session's footprint and spills idle ones once the total goes over `max_bytes`.
+
+    `state` is the session's state mapping (the app passes the SafeSessionState
+    of its latest run, which wraps the session's state for as long as the
+    session exists). `is_alive(runtime_id)` says whether the session with that
+    runtime id (Streamlit's session id, given at check-in) still exists; one
+    that hasn't for `closed_grace` seconds is forgotten, so the manager doesn't
+    keep a closed tab's chats. Sessions without a runtime id, or without
+    `is_alive`, are only dropped by `forget`. Sessions idle for less than `idle_seconds` are
+    never spilled, even if that leaves the total over the cap.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, idle_seconds=DEFAULT_IDLE_SECONDS, spill_dir=DEFAULT_SPILL_DIR,
+                 forget_after=DEFAULT_FORGET_AFTER, is_alive=None, closed_grace=0.0, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.spill_dir = spill_dir
+        self.forget_after = forget_after
+        self.is_alive = is_alive
+        self.closed_grace = closed_grace
+        self.clock = clock
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evictions = 0
+        self.rehydrations = 0
+        self.spill_errors = 0
+        self.forgotten = 0
+        self.bytes_spilled = 0 # Footprint moved out of memory, over the manager's lifetime
+        self._prune_spill_dir()
+
+    @classmethod
+    def from_env(cls, environ=os.environ, is_alive=None, closed_grace=0.0):
+        return cls(
+            max_bytes=int(float(environ.get("CHARACTER_AI_SESSION_MEMORY_MB") or DEFAULT_MAX_BYTES / 1024 / 1024) * 1024 * 1024),
+            idle_seconds=float(environ.get("CHARACTER_AI_SESSION_IDLE_SECONDS") or DEFAULT_IDLE_SECONDS),
+            spill_dir=environ.get("CHARACTER_AI_SESSION_SPILL_DIR") or DEFAULT_SPILL_DIR,
+            is_alive=is_alive,
+            closed_grace=closed_grace,
+        )
+
+    def checkin(self, session_id, state, runtime_id=None):
+        """Mark the session active at the start of a rerun; returns True if its chats were read back from disk."""
+        with self._lock:
+            now = self.clock()
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = TrackedSession(session_id, state, now, runtime_id)
+            session.state = state
+            session.runtime_id = runtime_id
+            session.last_active = now
+            rehydrated = session.spill_path is not None and self._rehydrate(session, state)
+            self._set_size(session, estimate_session_bytes(state))
+            self._forget_closed()
+            return rehydrated
+
+    def update(self, session_id, state, runtime_id=None):
+        """Re-measure a session after it changed (e.g. a new turn) and spill others if over the cap."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = TrackedSession(session_id, state, self.clock(), runtime_id)
+            self._set_size(session, estimate_session_bytes(state))
+            self._forget_closed()
+            self._enforce_cap(current=session)
+
+    def forget(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._drop(session)
+
+    def stats(self):
+        with self._lock:
+            self._forget_closed()
+            spilled = sum(session.spill_path is not None for session in self._sessions.values())
+            return {"sessions": len(self._sessions), "in_memory": len(self._sessions) - spilled, "spilled": spilled,
+                    "bytes": self.total_bytes, "max_bytes": self.max_bytes, "evictions": self.evictions,
+                    "rehydrations": self.rehydrations, "spill_errors": self.spill_errors, "forgotten": self.forgotten,
+                    "bytes_spilled": self.bytes_spilled}
+
+    def _prune_spill_dir(self):
+        # Files left by an earlier server process belong to sessions that no longer exist
+        try:
+            names = os.listdir(self.spill_dir)
+        except OSError:
+            return
+        cutoff = time.time() - self.forget_after
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    # --- Internals; callers hold the lock ---
+
+    def _set_size(self, session, size):
+        self.total_bytes += size - session.size
+        session.size = size
+
+    def _enforce_cap(self, current):
+        if self.total_bytes <= self.max_bytes:
+            return
+        idle_before = self.clock() - self.idle_seconds
+        candidates = sorted(
+            (session for session in self._sessions.values()
+             if session is not current and session.spill_path is None and session.last_active <= idle_before),
+            key=lambda session: session.last_active,
+        )
+        for session in candidates:
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._spill(session)
+
+    def _spill_path(self, session_id):
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def _spill(self, session):
+        state = session.state
+        path = self._spill_path(session.session_id)
+        try:
+            data = dump_session_state(state)
+            os.makedirs(self.spill_dir, exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            self.spill_errors += 1 # Keep the session in memory rather than lose its chats
+            return
+        clear_session_state(state)
+        session.spill_path = path
+        self.bytes_spilled += session.size
+        self.evictions += 1
+        self._set_size(session, estimate_session_bytes(state))
+
+    def _rehydrate(self, session, state):
+        path, session.spill_path = session.spill_path, None
+        try:
+            with open(path, encoding="utf-8") as f:
+                restore_session_state(state, json.load(f))
+        except (OSError, KeyError, TypeError, ValueError):
+            self.spill_errors += 1 # Start fresh; saved conversations still resume from the store
+            return False
+        finally:
+            _remove(path)
+        self.rehydrations += 1
+        return True
+
+    def _forget_closed(self):
+        if self.is_alive is None:
+            return
+        now = self.clock()
+        closed = []
+        for session in self._sessions.values():
+            if session.runtime_id is None or self.is_alive(session.runtime_id):
+                session.closed_since = None
+            elif session.closed_since is None:
+                session.closed_since = now # Maybe only disconnected: give the tab time to reconnect
+            elif now - session.closed_since >= self.closed_grace:
+                closed.append(session)
+        for session in closed:
+            del self._sessions[session.session_id]
+            self._drop(session)
+            self.forgotten += 1
+
+    def _drop(self, session):
+        self.total_bytes -= session.size
+        if session.spill_path is not None:
+            _remove(session.spill_path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
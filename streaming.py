@@ -0,0 +1,53 @@
+"""Helpers for streaming character replies chunk by chunk.
+
+Kept free of Streamlit so the timing logic can be driven by any iterable of
+chunks (a real Gemini stream or a fake generator).
+"""
+import time
+
+
+class TurnTiming:
+    """Timing for one generated reply, in seconds."""
+
+    __slots__ = ("started_at", "time_to_first_token", "total_time", "chunk_count")
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.time_to_first_token = None
+        self.total_time = None
+        self.chunk_count = 0
+
+    def as_dict(self):
+        return {
+            "time_to_first_token": self.time_to_first_token,
+            "total_time": self.total_time,
+            "chunk_count": self.chunk_count,
+        }
+
+
+def iter_chunk_text(response):
+    """Yield the text of each chunk in a streamed response, skipping empty ones."""
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            # Chunks without text parts (e.g. safety or finish metadata) raise on .text
+            continue
+        if text:
+            yield text
+
+
+def timed_chunks(chunks, timing, clock=time.perf_counter):
+    """Pass chunks through unchanged while filling in `timing`.
+
+    `timing.total_time` is set once the stream is exhausted (or abandoned).
+    """
+    try:
+        for text in chunks:
+            if timing.time_to_first_token is None:
+                timing.time_to_first_token = clock() - timing.started_at
+            timing.chunk_count += 1
+            yield text
+    finally:
+        timing.total_time = clock() - timing.started_at
+
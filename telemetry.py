@@ -0,0 +1,117 @@
+"""Per-turn telemetry: one structured event per generation call.
+
+Events are appended to a JSON-lines file (if a path is configured) and folded
+into an in-process aggregate that the sidebar can show. Both are shared by
+every session in the server process.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+LATENCY_SAMPLE_SIZE = 1000 # Recent latencies kept for percentiles
+
+
+def make_turn_event(character, model, temperature, max_tokens, latency, status="ok", error=None,
+                    time_to_first_token=None, usage=None, history_messages=0, history_tokens=None,
+                    reply_source=None, mode="single", route=None, hedge=None):
+    """Build the dict recorded for one turn. `usage` is the backend's token usage dict.
+
+    `route` is the model router's decision (`RouteDecision.as_dict()`) for an auto-routed turn,
+    `hedge` how a hedged request went (`GenerationJob.hedge`).
+    """
+    usage = usage or {}
+    return {
+        "ts": time.time(),
+        "mode": mode,
+        "character": character,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "latency": latency,
+        "time_to_first_token": time_to_first_token,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "cached_tokens": usage.get("cached_tokens"),
+        "output_tokens": usage.get("output_tokens"),
+        "history_messages": history_messages,
+        "history_tokens": history_tokens,
+        "reply_source": reply_source,
+        "status": status,
+        "error": None if error is None else f"{type(error).__name__}: {error}",
+        "route": route,
+        "hedge": hedge,
+    }
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+class Telemetry:
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+        self._latencies = deque(maxlen=LATENCY_SAMPLE_SIZE)
+        self._totals = {"turns": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0,
+                        "hedged": 0, "hedge_wins": 0}
+        self._by_model = {}
+        self._by_routing = {} # "auto" / "manual" model choice, to compare routed turns with fixed-model ones
+
+    def record(self, event):
+        line = json.dumps(event, ensure_ascii=False)
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+            self._totals["turns"] += 1
+            model_totals = self._by_model.setdefault(event["model"], {"turns": 0, "errors": 0, "latency_sum": 0.0})
+            model_totals["turns"] += 1
+            route = event.get("route")
+            routing_totals = self._by_routing.setdefault("auto" if route else "manual",
+                                                         {"turns": 0, "errors": 0, "latency_sum": 0.0, "fallbacks": 0})
+            routing_totals["turns"] += 1
+            routing_totals["fallbacks"] += len(route["fallbacks"]) if route else 0
+            hedge = event.get("hedge")
+            if hedge and hedge["hedged"]:
+                self._totals["hedged"] += 1
+                self._totals["hedge_wins"] += hedge["winner"] == 1
+            if event["status"] != "ok":
+                self._totals["errors"] += 1
+                model_totals["errors"] += 1
+                routing_totals["errors"] += 1
+                return
+            self._latencies.append(event["latency"])
+            model_totals["latency_sum"] += event["latency"]
+            routing_totals["latency_sum"] += event["latency"]
+            self._totals["prompt_tokens"] += event["prompt_tokens"] or 0
+            self._totals["cached_tokens"] += event.get("cached_tokens") or 0
+            self._totals["output_tokens"] += event["output_tokens"] or 0
+
+    def summary(self):
+        with self._lock:
+            totals = dict(self._totals)
+            latencies = sorted(self._latencies)
+            by_model = {name: dict(values) for name, values in self._by_model.items()}
+            by_routing = {name: dict(values) for name, values in self._by_routing.items()}
+        ok_turns = totals["turns"] - totals["errors"]
+        totals["error_rate"] = totals["errors"] / totals["turns"] if totals["turns"] else 0.0
+        totals["latency_p50"] = _percentile(latencies, 50)
+        totals["latency_p95"] = _percentile(latencies, 95)
+        totals["avg_prompt_tokens"] = totals["prompt_tokens"] / ok_turns if ok_turns else 0.0
+        totals["cached_token_rate"] = totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0
+        totals["avg_output_tokens"] = totals["output_tokens"] / ok_turns if ok_turns else 0.0
+        for values in list(by_model.values()) + list(by_routing.values()):
+            ok = values["turns"] - values["errors"]
+            values["avg_latency"] = values.pop("latency_sum") / ok if ok else None
+        totals["by_model"] = by_model
+        totals["by_routing"] = by_routing
+        return totals
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
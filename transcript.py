@@ -0,0 +1,43 @@
+"""Compact transcript records shared by rendering, export and storage.
+
+A chat used to be held as a list of `{"role", "content"}` dicts in session
+state, with a second copy of the replayed turns kept inside the SDK chat
+session. Turns are now slotted records whose role and character strings are
+interned, so every turn in every session points at the same few role/name
+objects. The transcript is the only copy of the conversation a session keeps
+between turns: the backend history is rebuilt from the ContextWindow (which
+references the same strings) right before each send and dropped after it.
+"""
+import sys
+
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+
+class Turn:
+    """One message of a chat. `character` is set for assistant turns in group chats."""
+
+    __slots__ = ("role", "content", "character")
+
+    def __init__(self, role, content, character=None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.character = sys.intern(character) if character is not None else None
+
+    def __repr__(self):
+        return f"Turn({self.role!r}, {self.content[:30]!r}{'' if self.character is None else ', ' + repr(self.character)})"
+
+    def as_message(self):
+        """Plain-dict form for JSON export and other external formats."""
+        message = {"role": self.role, "content": self.content}
+        if self.character is not None:
+            message["character"] = self.character
+        return message
+
+
+def user_turn(content):
+    return Turn(USER, content)
+
+
+def assistant_turn(content, character=None):
+    return Turn(ASSISTANT, content, character)